@@ -7,6 +7,16 @@ from pyglm import glm
 마우스, 키보드 event를 처리하기 위한 함수입니다.
 """
 
+# 화면을 다시 그려야 할 때 이어서 렌더링할 프레임 수 (ImGui는 hover/click이 반영되는 데 몇 프레임이 필요함)
+REDRAW_FRAMES = 3
+
+def request_redraw(state, frames=REDRAW_FRAMES):
+    """
+    일시정지 중에도 frames 프레임 동안 화면을 다시 그리도록 표시합니다.
+    :param state: main에서 프로그램을 관리하기 위한 global 한 딕셔너리
+    """
+    state['redraw_frames'] = max(state.get('redraw_frames', 0), frames)
+
 def update_eye(center, distance, yaw, pitch):
     """
     변화하는 input값에 따라 카메라를 update하는 함수입니다
@@ -38,6 +48,7 @@ def handle_mouse_motion(event, state):
         state['yaw'] -= dx * sensitivity
         state['pitch'] += dy * sensitivity
         state['eye'] = update_eye(state['center'], state['distance'], state['yaw'], state['pitch'])
+        request_redraw(state)
     elif state['is_translating']:
         sensitivity = 0.005 * state['distance']
         view_dir = glm.normalize(state['center'] - state['eye'])
@@ -46,6 +57,7 @@ def handle_mouse_motion(event, state):
         translation = (-dx * right + dy * up) * sensitivity
         state['center'] += translation
         state['eye'] = update_eye(state['center'], state['distance'], state['yaw'], state['pitch'])
+        request_redraw(state)
 
 def handle_mouse_button(event, state):
     """
@@ -83,3 +95,4 @@ def handle_mouse_wheel(event, state):
             state['distance'] += zoom_sensitivity * state['distance']
     state['distance'] = max(state['distance'], 0.1)
     state['eye'] = update_eye(state['center'], state['distance'], state['yaw'], state['pitch'])
+    request_redraw(state)
@@ -1,7 +1,10 @@
+import ctypes
+import itertools
+import weakref
 from OpenGL.GL import *
 from pyglm import glm
 import numpy as np
-from utils import draw_colored_cube, draw_colored_sphere, bone_rotation, draw_arrow, draw_undercircle
+from utils import draw_arrow, draw_undercircle, cube_mesh, sphere_mesh
 
 joint_size = 3
 
@@ -10,51 +13,63 @@ joint_size = 3
 def glm_mat4_to_glf(m: glm.mat4) -> np.ndarray:
     return np.array(m.to_list(), dtype=np.float32).flatten()
 
-def draw_humanoid(root_joint, color):
+class InstanceBuffer:
     """
-    Skeleton을 그리기 위한 함수입니다.
-    :param root_joint: 그릴 joint (전역 kinematics가 이미 계산되어 있음)
-    :param color: RGB 컬러 (tuple 또는 list of 3 floats)
+    프레임마다 재사용하는 float32 버퍼입니다.
+    필요한 행 수가 capacity를 넘을 때만 두 배 이상으로 늘려 새로 할당하고, 그 횟수를 allocations로 셉니다.
+    정상 재생 중에는 allocations가 더 이상 늘지 않아야 합니다.
     """
-    glPushMatrix()
-    glMultMatrixf(glm_mat4_to_glf(root_joint.kinematics))
-    draw_joint(root_joint.children[0], color)
-    glPopMatrix()
 
-def draw_joint(joint, color):
-    """
-    Joint를 그리기 위한 함수입니다.
-    전역 좌표계의 kinematics를 그대로 적용하고, 관절이면 sphere, 아니라면 뼈대를 그립니다.
-    :param color: RGB 컬러
-    """
-    glPushMatrix()
-    glMultMatrixf(glm_mat4_to_glf(joint.kinematics))
-    
-    if joint.name != "joint_Root":
-        draw_colored_sphere(joint_size)
-    
-    for child in joint.children:
-        if joint.name != "joint_Root":
-            draw_bone(child.offset, color)
-        draw_joint(child, color)
-    
-    glPopMatrix()
+    def __init__(self, row_shape, capacity=256):
+        self.row_shape = tuple(row_shape)
+        self.allocations = 0
+        self._allocate(capacity)
 
-def draw_bone(offset, color):
+    def _allocate(self, capacity):
+        self.data = np.empty((capacity,) + self.row_shape, dtype=np.float32)
+        self.allocations += 1
+
+    @property
+    def capacity(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def reserve(self, count):
+        """
+        count행 이상을 담을 수 있는 버퍼를 반환합니다. 늘어날 때는 기존 내용이 보존되지 않습니다.
+        """
+        if count > len(self.data):
+            self._allocate(max(count, 2 * len(self.data)))
+        return self.data
+
+
+def write_skeleton_matrices(transforms, geometry, bone_rows, joint_rows, gather, joint_scale=1.0):
     """
-    Skeleton에서 뼈를 그리기 위한 함수입니다.
-    :param offset: 뼈 길이를 구하기 위한 값
-    :param color: RGB 컬러
+    skeleton 하나의 뼈/관절 행렬을 OpenGL용 column-major로 bone_rows, joint_rows에 바로 씁니다.
+    gather를 scratch로 사용하므로 joint 수에 비례하는 임시 배열을 만들지 않습니다.
+    :param transforms: (J, 4, 4) float32 global joint transform
+    :param geometry: skeleton_bone_geometry 결과
+    :param bone_rows: (B, >=16) float32 배열 view (앞 16개에 행렬을 씀)
+    :param joint_rows: (S, >=16) float32 배열 view
+    :param gather: (>=max(B, S), 4, 4) float32 scratch 배열
+    :param joint_scale: 관절 행렬의 회전 부분에 곱할 크기 (단위 sphere mesh를 쓸 때 joint_size)
     """
-    mid = [offset[0] / 2.0, offset[1] / 2.0, offset[2] / 2.0]
-    rot_quat = bone_rotation(glm.vec3(*offset))
-    rot_mat = glm.mat4_cast(rot_quat)
-    glPushMatrix()
-    glTranslatef(*mid)
-    glMultMatrixf(np.array(rot_mat, dtype=np.float32).flatten())
-    glScalef(joint_size, abs(glm.length(glm.vec3(*offset)) - 2 * joint_size) / 2, joint_size / 3)
-    draw_colored_cube(1, color=color)
-    glPopMatrix()
+    bone_joints, bone_locals, sphere_joints = geometry
+    num_bones, num_joints = len(bone_joints), len(sphere_joints)
+    # (N, 16) 행의 column-major 행렬을 전치된 (N, 4, 4) view로 보면 보통의 행렬로 쓸 수 있습니다.
+    bone_out = bone_rows[:, :16].reshape(num_bones, 4, 4).transpose(0, 2, 1)
+    joint_out = joint_rows[:, :16].reshape(num_joints, 4, 4).transpose(0, 2, 1)
+
+    np.take(transforms, bone_joints, axis=0, out=gather[:num_bones], mode='clip')
+    np.matmul(gather[:num_bones], bone_locals, out=bone_out)
+    np.take(transforms, sphere_joints, axis=0, out=gather[:num_joints], mode='clip')
+    joint_out[...] = gather[:num_joints]
+    if joint_scale != 1.0:
+        joint_out[:, :, :3] *= joint_scale
+
 
 def draw_virtual_root_axis(kinematics, color, circle_radius=10, arrow_length=20):
     """
@@ -68,3 +83,279 @@ def draw_virtual_root_axis(kinematics, color, circle_radius=10, arrow_length=20)
     glColor3f(1.0, 1.0, 1.0)
     draw_undercircle(10)
     glPopMatrix()
+
+
+_VERTEX_SHADER = """
+#version 120
+attribute vec3 position;
+attribute vec3 normal;
+attribute vec4 instance_color;
+attribute mat4 instance_matrix;
+varying vec3 v_normal;
+varying vec4 v_color;
+void main() {
+    gl_Position = gl_ModelViewProjectionMatrix * (instance_matrix * vec4(position, 1.0));
+    v_normal = gl_NormalMatrix * (mat3(instance_matrix) * normal);
+    v_color = instance_color;
+}
+"""
+
+# set_lights()로 설정한 고정 파이프라인 조명(GL_LIGHT0, color material)을 그대로 읽어 사용합니다.
+_FRAGMENT_SHADER = """
+#version 120
+varying vec3 v_normal;
+varying vec4 v_color;
+void main() {
+    vec3 n = normalize(v_normal);
+    vec3 l = normalize(gl_LightSource[0].position.xyz);
+    float ndotl = max(dot(n, l), 0.0);
+    vec3 color = v_color.rgb * (gl_LightModel.ambient.rgb + gl_LightSource[0].ambient.rgb
+                                + gl_LightSource[0].diffuse.rgb * ndotl);
+    if (ndotl > 0.0) {
+        vec3 h = normalize(l + vec3(0.0, 0.0, 1.0));
+        color += gl_FrontMaterial.specular.rgb * gl_LightSource[0].specular.rgb
+                 * pow(max(dot(n, h), 0.0), gl_FrontMaterial.shininess);
+    }
+    gl_FragColor = vec4(color, v_color.a);
+}
+"""
+
+_ATTRIB_POSITION, _ATTRIB_NORMAL, _ATTRIB_COLOR, _ATTRIB_MATRIX = 0, 1, 2, 3
+_INSTANCE_FLOATS = 20  # column-major mat4 16개 + RGBA 4개
+_JOINT_COLOR = (1.0, 0.0, 0.0)
+
+
+def _compile_program(vertex_source, fragment_source):
+    program = glCreateProgram()
+    for shader_type, source in ((GL_VERTEX_SHADER, vertex_source), (GL_FRAGMENT_SHADER, fragment_source)):
+        shader = glCreateShader(shader_type)
+        glShaderSource(shader, source)
+        glCompileShader(shader)
+        if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+            raise RuntimeError(glGetShaderInfoLog(shader))
+        glAttachShader(program, shader)
+        glDeleteShader(shader)
+    glBindAttribLocation(program, _ATTRIB_POSITION, "position")
+    glBindAttribLocation(program, _ATTRIB_NORMAL, "normal")
+    glBindAttribLocation(program, _ATTRIB_COLOR, "instance_color")
+    glBindAttribLocation(program, _ATTRIB_MATRIX, "instance_matrix")
+    glLinkProgram(program)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        raise RuntimeError(glGetProgramInfoLog(program))
+    return program
+
+
+# Skeleton -> skeleton_bone_geometry 결과
+_bone_geometry = weakref.WeakKeyDictionary()
+
+
+def skeleton_bone_geometry(skeleton):
+    """
+    그릴 뼈(cube)와 관절(sphere) instance를 고릅니다. root와 "joint_Root"는 그리지 않습니다.
+    뼈의 local 행렬은 Skeleton.bone_locals를 사용하고, 결과는 skeleton마다 한 번만 계산합니다.
+    :return: (bone_joints (B,), bone_locals (B, 4, 4), sphere_joints (S,))
+    """
+    geometry = _bone_geometry.get(skeleton)
+    if geometry is None:
+        drawn = (skeleton.parents >= 0) & (np.array(skeleton.names) != "joint_Root")
+        # 뼈를 부모 joint 순서로 모아 둡니다.
+        bones = np.flatnonzero(drawn[skeleton.bone_joints])
+        bones = bones[np.argsort(skeleton.bone_joints[bones], kind='stable')]
+        geometry = (skeleton.bone_joints[bones],
+                    skeleton.bone_locals(joint_size)[bones],
+                    np.flatnonzero(drawn))
+        _bone_geometry[skeleton] = geometry
+    return geometry
+
+
+class SkeletonRenderer:
+    """
+    모든 skeleton의 뼈와 관절을 instancing으로 그리는 retained-mode renderer입니다.
+    단위 cube/sphere mesh는 VBO에 한 번만 올리고, 매 프레임 instance 행렬만 하나의 버퍼로 업로드해
+    뼈 한 번, 관절 한 번의 draw call로 그립니다.
+    GL 3.3 / ARB_instanced_arrays가 없는 (legacy) context에서는 같은 VBO를 instance마다
+    glMultMatrixf + glDrawArrays로 그리는 방식으로 동작합니다.
+    사용법: 프레임마다 add()로 skeleton들을 모은 뒤 flush()를 한 번 호출합니다.
+    :param sphere_detail: 관절 sphere mesh의 (slices, stacks). None이면 utils.SPHERE_DETAIL을 사용합니다.
+    """
+
+    def __init__(self, sphere_detail=None):
+        self.sphere_detail = sphere_detail
+        self.initialized = False
+        self.instanced = False
+        self.program = None
+        self.batches = []
+        self.instances = InstanceBuffer((_INSTANCE_FLOATS,))
+        self.gather = InstanceBuffer((4, 4))
+        self.gpu_capacity = 0
+        self.gpu_allocations = 0
+        self.uploaded_bytes = 0
+        self.frames = 0
+        self.legacy_rows = []
+        self.legacy_rows_allocation = 0
+
+    def _init_gl(self):
+        self.initialized = True
+        self.meshes = {}
+        sphere = sphere_mesh(*self.sphere_detail) if self.sphere_detail else sphere_mesh()
+        for name, mesh in (('bone', cube_mesh()), ('joint', sphere)):
+            vbo = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+            glBufferData(GL_ARRAY_BUFFER, mesh.nbytes, mesh, GL_STATIC_DRAW)
+            self.meshes[name] = (vbo, len(mesh))
+        self.instance_vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        try:
+            has_instancing = bool(glVertexAttribDivisor) and bool(glDrawArraysInstanced)
+            if has_instancing:
+                self.program = _compile_program(_VERTEX_SHADER, _FRAGMENT_SHADER)
+                self.instanced = True
+        except Exception as e:
+            print("Instanced skeleton rendering unavailable, using legacy path:", e)
+            self.instanced = False
+
+    def add(self, skeleton, transforms, color):
+        """
+        이번 프레임에 그릴 skeleton을 추가합니다.
+        :param transforms: (J, 4, 4) global joint transform
+        :return: 이 skeleton이 그릴 instance (뼈 + 관절) 수
+        """
+        self.batches.append((skeleton, transforms, color))
+        bone_joints, _, sphere_joints = skeleton_bone_geometry(skeleton)
+        return len(bone_joints) + len(sphere_joints)
+
+    def _instances(self):
+        """
+        모은 skeleton들의 instance 데이터를 재사용 버퍼에 씁니다. 앞쪽은 뼈, 뒤쪽은 관절입니다.
+        :return: (instances (N, 20) view, 뼈 instance 수)
+        """
+        geometries = [skeleton_bone_geometry(skeleton) for skeleton, _, _ in self.batches]
+        num_bones = sum(len(bone_joints) for bone_joints, _, _ in geometries)
+        num_joints = sum(len(sphere_joints) for _, _, sphere_joints in geometries)
+        largest = max(max(len(bone_joints), len(sphere_joints)) for bone_joints, _, sphere_joints in geometries)
+        data = self.instances.reserve(num_bones + num_joints)
+        gather = self.gather.reserve(largest)
+
+        bone_start, joint_start = 0, num_bones
+        for (_, transforms, color), geometry in zip(self.batches, geometries):
+            bone_stop = bone_start + len(geometry[0])
+            joint_stop = joint_start + len(geometry[2])
+            bone_rows, joint_rows = data[bone_start:bone_stop], data[joint_start:joint_stop]
+            write_skeleton_matrices(transforms, geometry, bone_rows, joint_rows, gather, joint_scale=joint_size)
+            bone_rows[:, 16:19] = color
+            joint_rows[:, 16:19] = _JOINT_COLOR
+            bone_start, joint_start = bone_stop, joint_stop
+        data[:num_bones + num_joints, 19] = 1.0
+        return data[:num_bones + num_joints], num_bones
+
+    def flush(self):
+        """
+        add()로 모은 skeleton들을 그리고 목록을 비웁니다.
+        """
+        if not self.batches:
+            return
+        if not self.initialized:
+            self._init_gl()
+        instances, num_bones = self._instances()
+        self.batches = []
+        self.frames += 1
+        if self.instanced:
+            self._draw_instanced(instances, num_bones)
+        else:
+            self._draw_legacy(instances, num_bones)
+
+    def stats(self):
+        """
+        버퍼 할당 카운터입니다. 정상 재생 중에는 *_allocations가 늘지 않아야 합니다.
+        """
+        return {
+            'frames': self.frames,
+            'instance_allocations': self.instances.allocations,
+            'gather_allocations': self.gather.allocations,
+            'gpu_allocations': self.gpu_allocations,
+            'instance_capacity': self.instances.capacity,
+            'uploaded_bytes': self.uploaded_bytes,
+        }
+
+    def _bind_mesh(self, name):
+        vbo, count = self.meshes[name]
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        return count
+
+    def _upload(self, instances):
+        # GPU 버퍼도 CPU 버퍼 크기에 맞춰 커질 때만 다시 할당하고, 평소에는 사용한 부분만 덮어씁니다.
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        if self.gpu_capacity < self.instances.nbytes:
+            self.gpu_capacity = self.instances.nbytes
+            glBufferData(GL_ARRAY_BUFFER, self.gpu_capacity, None, GL_STREAM_DRAW)
+            self.gpu_allocations += 1
+        glBufferSubData(GL_ARRAY_BUFFER, 0, instances.nbytes, instances)
+        self.uploaded_bytes += instances.nbytes
+
+    def _draw_instanced(self, instances, num_bones):
+        self._upload(instances)
+
+        glUseProgram(self.program)
+        for location in range(_ATTRIB_POSITION, _ATTRIB_MATRIX + 4):
+            glEnableVertexAttribArray(location)
+        for location in range(_ATTRIB_COLOR, _ATTRIB_MATRIX + 4):
+            glVertexAttribDivisor(location, 1)
+
+        stride = _INSTANCE_FLOATS * 4
+        first_instance = 0
+        for name, count in (('bone', num_bones), ('joint', len(instances) - num_bones)):
+            if count:
+                num_vertices = self._bind_mesh(name)
+                glVertexAttribPointer(_ATTRIB_POSITION, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(0))
+                glVertexAttribPointer(_ATTRIB_NORMAL, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(12))
+                glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+                base = first_instance * stride
+                for column in range(4):
+                    glVertexAttribPointer(_ATTRIB_MATRIX + column, 4, GL_FLOAT, GL_FALSE, stride,
+                                          ctypes.c_void_p(base + column * 16))
+                glVertexAttribPointer(_ATTRIB_COLOR, 4, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(base + 64))
+                glDrawArraysInstanced(GL_TRIANGLES, 0, num_vertices, count)
+            first_instance += count
+
+        # ImGui 등 고정 파이프라인 코드가 영향을 받지 않도록 상태를 되돌립니다.
+        for location in range(_ATTRIB_COLOR, _ATTRIB_MATRIX + 4):
+            glVertexAttribDivisor(location, 0)
+        for location in range(_ATTRIB_POSITION, _ATTRIB_MATRIX + 4):
+            glDisableVertexAttribArray(location)
+        glUseProgram(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _legacy_rows(self):
+        # instance 버퍼의 행마다 (행렬, 색)을 가리키는 ctypes 배열을 버퍼가 할당될 때 한 번만 만들어 두고 재사용합니다.
+        # numpy slice를 넘기는 것보다 PyOpenGL의 변환 비용이 작고, 프레임마다 새 객체를 만들지 않습니다.
+        if self.legacy_rows_allocation != self.instances.allocations:
+            data = self.instances.data
+            stride = _INSTANCE_FLOATS * 4
+            self.legacy_rows = [((ctypes.c_float * 16).from_buffer(data, i * stride),
+                                 (ctypes.c_float * 4).from_buffer(data, i * stride + 64))
+                                for i in range(len(data))]
+            self.legacy_rows_allocation = self.instances.allocations
+        return self.legacy_rows
+
+    def _draw_legacy(self, instances, num_bones):
+        rows = self._legacy_rows()
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnable(GL_NORMALIZE)
+        for name, start, stop in (('bone', 0, num_bones), ('joint', num_bones, len(instances))):
+            if start == stop:
+                continue
+            num_vertices = self._bind_mesh(name)
+            glVertexPointer(3, GL_FLOAT, 24, ctypes.c_void_p(0))
+            glNormalPointer(GL_FLOAT, 24, ctypes.c_void_p(12))
+            for matrix, color in itertools.islice(rows, start, stop):
+                glPushMatrix()
+                glMultMatrixf(matrix)
+                glColor4fv(color)
+                glDrawArrays(GL_TRIANGLES, 0, num_vertices)
+                glPopMatrix()
+        glDisable(GL_NORMALIZE)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
@@ -1,6 +1,11 @@
+import time
 import imgui
-from bvh_controller import connect
+from feature_index import FeatureIndex
+from transition import connect_best, sequence_best
 from utils import blend_color
+from pose_cache import default_pose_cache
+from playback import seek_entry
+from Events import request_redraw
 
 def draw_control_panel(state, viewport):
     panel_height = int(viewport.work_size.y * 0.25)
@@ -18,21 +23,46 @@ def draw_control_panel(state, viewport):
 
     imgui.begin("Control Panel", flags=imgui.WINDOW_NO_TITLE_BAR | imgui.WINDOW_NO_RESIZE)
 
-    if state.get('motions'):
+    changed, crowd_mode = imgui.checkbox("Crowd mode", state.get('crowd_mode', False))
+    if changed:
+        state['crowd_mode'] = crowd_mode
+    crowd_stats = state.get('crowd_stats')
+    if state.get('crowd_mode') and crowd_stats:
+        imgui.same_line()
+        imgui.text(f"{crowd_stats['total']} motions: {crowd_stats['culled']} culled, {crowd_stats['full']} full, "
+                   f"{crowd_stats['stick']} stick, {crowd_stats['points']} points")
+
+    if state.get('crowd_mode') and state.get('motions'):
+        # motion마다 slider를 만들면 UI 비용이 항목 수에 비례하므로 crowd mode에서는 요약만 보여줍니다.
+        imgui.text(f"{len(state['motions'])} motions loaded.")
+        imgui.separator()
+    elif state.get('motions'):
         for idx, motion in enumerate(state['motions']):
             imgui.text(motion['name'])
             changed, frame_val = imgui.slider_int(f"Frame##{idx}", motion['frame_idx'] + 1, 0, motion['frame_len'])
             if changed:
-                motion['frame_idx'] = frame_val - 1
+                seek_entry(motion, frame_val - 1)
+                request_redraw(state)
             changed, visible = imgui.checkbox(f"Visible##{idx}", motion.get('visible', True))
             if changed:
                 motion['visible'] = visible
+                request_redraw(state)
             imgui.separator()
     else:
         imgui.text("No motion loaded.")
 
     if imgui.button("Play/Pause", width=100, height=30):
         state['stop'] = not state['stop']
+    imgui.same_line()
+    _, state['interpolate'] = imgui.checkbox("Interpolate", state.get('interpolate', True))
+
+    stats = default_pose_cache.stats()
+    imgui.text(f"Pose cache: {stats['hits']} hits / {stats['misses']} misses, "
+               f"{stats['bytes'] / 1024 ** 2:.1f} MB")
+    if state.get('renderer') is not None:
+        render_stats = state['renderer'].stats()
+        imgui.text(f"Instance buffer: {render_stats['instance_capacity']} slots, "
+                   f"{render_stats['instance_allocations'] + render_stats['gpu_allocations']} allocations")
 
     imgui.end()
 
@@ -56,6 +86,13 @@ def draw_side_panel(state, viewport):
     if imgui.button("Load BVH File", width=120, height=30):
         state['open_file_dialog'] = True
 
+    loader = state.get('loader')
+    if loader is not None and loader.busy:
+        done, total = loader.progress()
+        imgui.progress_bar(done / total, (side_width - 20, 0), f"Loading {done}/{total}")
+        for pending in loader.pending:
+            imgui.text_disabled(f"{pending.name} (loading... {pending.elapsed:.1f}s)")
+
     if state.get('motions'):
         imgui.separator()
         imgui.text("Loaded Motions:")
@@ -78,22 +115,175 @@ def draw_side_panel(state, viewport):
 
             if imgui.button("Connect Selected Motions", width=200, height=30):
                 if state['connect_motion_a'] != state['connect_motion_b']:
-                    motion_a = state['motions'][state['connect_motion_a']]['motion']
-                    motion_b = state['motions'][state['connect_motion_b']]['motion']
-                    root_a = state['motions'][state['connect_motion_a']]['root']
-                    connected_motion = connect(motion_a[:-200], motion_b[200:])
-                    new_name = f"Connected({state['motions'][state['connect_motion_a']]['name']}+" \
-                               f"{state['motions'][state['connect_motion_b']]['name']})"
-                    new_entry = {
+                    entry_a = state['motions'][state['connect_motion_a']]
+                    entry_b = state['motions'][state['connect_motion_b']]
+                    try:
+                        # A의 끝과 B의 앞에서 pose가 가장 비슷한 구간을 찾아 그 구간에서 blending합니다.
+                        connected_motion, _ = connect_best(entry_a['motion'], entry_a['skeleton'],
+                                                           entry_b['motion'], entry_b['skeleton'])
+                    except ValueError as e:
+                        print("Cannot connect motions:", e)
+                    else:
+                        new_name = f"Connected({entry_a['name']}+{entry_b['name']})"
+                        new_entry = {
+                            'name': new_name,
+                            'skeleton': entry_a['skeleton'],
+                            'motion': connected_motion,
+                            'frame_len': connected_motion.frames,
+                            'visible': True,
+                            'frame_idx': 0,
+                            'time': 0.0,
+                            'color': blend_color(entry_a['color'], entry_b['color'])
+                        }
+                        state['motions'].append(new_entry)
+                        request_redraw(state)
+                        print("Motions connected:", new_name)
+
+            visible_entries = [entry for entry in state['motions'] if entry.get('visible', True)]
+            if len(visible_entries) >= 2 and imgui.button("Sequence Visible Motions", width=200, height=30):
+                try:
+                    # 보이는 motion을 목록 순서대로 하나의 timeline으로 이어붙입니다. (source motion 복사 없음)
+                    sequence = sequence_best([entry['motion'] for entry in visible_entries],
+                                             [entry['skeleton'] for entry in visible_entries])
+                except ValueError as e:
+                    print("Cannot sequence motions:", e)
+                else:
+                    new_name = f"Sequence({len(visible_entries)} motions)"
+                    state['motions'].append({
                         'name': new_name,
-                        'root': root_a,
-                        'motion': connected_motion,
-                        'frame_len': connected_motion.frames,
+                        'skeleton': visible_entries[0]['skeleton'],
+                        'motion': sequence,
+                        'frame_len': sequence.frames,
                         'visible': True,
                         'frame_idx': 0,
-                        'color': blend_color(state['motions'][state['connect_motion_a']]['color'], state['motions'][state['connect_motion_b']]['color'])
-                    }
-                    state['motions'].append(new_entry)
-                    print("Motions connected:", new_name)
+                        'time': 0.0,
+                        'color': visible_entries[0]['color']
+                    })
+                    request_redraw(state)
+                    print("Motions sequenced:", new_name)
+
+        draw_matching_section(state)
+
+    imgui.end()
+
+
+def draw_matching_section(state):
+    """
+    선택한 motion의 현재 프레임과 가장 비슷한 프레임을 다른 clip에서 찾아 그 프레임으로 이동시킵니다.
+    index는 처음 검색할 때 만들고, 색인이 끝날 때까지 검색을 미뤘다가 실행합니다.
+    """
+    index = state.get('feature_index')
+    imgui.separator()
+    imgui.text("Motion Matching")
+    if index is None:
+        imgui.text_disabled("Frames are indexed on the first search.")
+    elif index.busy:
+        imgui.text_disabled(f"Indexing... {len(index)} frames")
+    else:
+        imgui.text(f"{len(index)} frames indexed")
+
+    state.setdefault('match_motion', 0)
+    state['match_motion'] = min(state['match_motion'], len(state['motions']) - 1)
+    _, state['match_motion'] = imgui.combo(
+        "Query", state['match_motion'], [m['name'] for m in state['motions']])
+
+    if imgui.button("Find Best Match", width=200, height=30):
+        if index is None:
+            index = state['feature_index'] = FeatureIndex()
+            for motion_entry in state['motions']:
+                index.add(motion_entry, motion_entry['motion'], motion_entry['skeleton'])
+        entry = state['motions'][state['match_motion']]
+        state['match_query'] = (entry, entry['frame_idx'])
+        if index.busy:
+            state['match_result'] = "Waiting for indexing..."
+
+    if state.get('match_query') is not None and not index.busy:
+        entry, frame_idx = state['match_query']
+        state['match_query'] = None
+        start_time = time.perf_counter()
+        try:
+            match = index.nearest_to_frame(entry['motion'], entry['skeleton'], frame_idx, exclude=entry)
+        except ValueError as e:
+            print("Cannot match motion:", e)
+            match = None
+        elapsed = (time.perf_counter() - start_time) * 1000
+        if match is None:
+            state['match_result'] = "No match found."
+        else:
+            matched_entry, frame, distance = match
+            seek_entry(matched_entry, frame)
+            request_redraw(state)
+            state['match_result'] = (f"{matched_entry['name']} frame {frame + 1} "
+                                     f"(distance {distance:.2f}, {elapsed:.2f} ms)")
+    if state.get('match_result'):
+        imgui.text_wrapped(state['match_result'])
+
+
+def draw_profiler_panel(state, viewport):
+    profiler = state.get('profiler')
+    if profiler is None:
+        return
+    side_width = int(viewport.work_size.x * 0.25)
+    panel_width = 320
+
+    # side panel 바로 왼쪽에 처음 한 번만 배치하고, 이후에는 사용자가 옮길 수 있게 둡니다.
+    imgui.set_next_window_position(
+        viewport.work_pos.x + viewport.work_size.x - side_width - panel_width,
+        viewport.work_pos.y,
+        condition=imgui.FIRST_USE_EVER
+    )
+    imgui.set_next_window_size(panel_width, int(viewport.work_size.y * 0.75), condition=imgui.FIRST_USE_EVER)
+
+    expanded, opened = imgui.begin("Profiler (F3)", closable=True)
+    if not opened:
+        state['show_profiler'] = False
+    if not expanded:
+        imgui.end()
+        return
+
+    if not profiler.frame_count:
+        # 첫 프레임에는 아직 sample이 없어 plot에 빈 배열을 넘길 수 없습니다.
+        imgui.text("Collecting samples...")
+        imgui.end()
+        return
+
+    stats = profiler.stats()
+    frame_avg, frame_max = stats.pop('frame')
+    frames = profiler.ordered_samples(profiler.frame_samples)
+    imgui.text(f"{1000.0 / frame_avg if frame_avg > 0 else 0.0:.1f} FPS, "
+               f"frame {frame_avg:.2f} ms avg / {frame_max:.2f} ms max")
+    imgui.plot_lines("##frame", frames, scale_min=0.0, scale_max=max(frame_max, 1.0),
+                     graph_size=(panel_width - 20, 60))
+
+    # 단계별 최근 프레임 시간 (순서가 매 프레임 바뀌지 않도록 루프 순서대로)
+    imgui.separator()
+    for name in profiler.stage_names:
+        avg, peak = stats[name]
+        imgui.text(f"{name:<10} {avg:6.2f} / {peak:6.2f} ms")
+        imgui.plot_histogram(f"##{name}", profiler.ordered_samples(profiler.samples[name]),
+                             scale_min=0.0, scale_max=max(peak, 0.1), graph_size=(panel_width - 20, 24))
+
+    if profiler.motion_costs:
+        # motion 수가 많아도 UI 비용이 늘지 않도록 비용이 큰 10개만 보여줍니다.
+        imgui.separator()
+        imgui.text(f"Per motion (fk / draw ms), top 10 of {len(profiler.motion_costs)}")
+        costs = sorted(profiler.motion_costs.items(), key=lambda item: -(item[1]['fk'] + item[1]['draw']))
+        for (_, name), cost in costs[:10]:
+            imgui.text(f"{cost['fk']:6.3f} / {cost['draw']:6.3f}  {name}")
+
+    imgui.separator()
+    if profiler.tracing:
+        if imgui.button("Stop trace"):
+            profiler.stop_trace()
+        imgui.same_line()
+        imgui.text(f"{len(profiler.trace_events)} events")
+    elif imgui.button("Start trace"):
+        profiler.start_trace()
+    if profiler.trace_events:
+        imgui.same_line()
+        if imgui.button("Export trace"):
+            path = time.strftime("trace_%Y%m%d_%H%M%S.json")
+            count = profiler.export_trace(path)
+            print(f"Profile trace: {count} events written to {path}")
 
     imgui.end()
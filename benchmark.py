@@ -0,0 +1,309 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bvh_controller import Skeleton, parse_bvh, get_preorder_joint_list, connect
+
+"""
+디스플레이 없이 로딩/FK/connect 파이프라인의 시간을 재는 benchmark입니다.
+joint 수, 회전 채널 순서, 프레임 수를 바꿔가며 synthetic BVH를 만들고 단계별 시간을 JSON으로 저장하며,
+저장해둔 baseline과 비교해 느려진 단계를 찾습니다.
+
+    python benchmark.py --frames 1000 100000 1000000 --output bench.json
+    python benchmark.py --baseline bench.json
+"""
+
+BLOCK_SIZE = 4096
+DEFAULT_THRESHOLD = 1.25
+ROTATION_ORDERS = ('ZXY', 'ZYX', 'XYZ', 'YXZ')
+LIMB_COUNT = 5
+
+
+def synthetic_hierarchy(num_joints, rotation_order='ZXY', limbs=LIMB_COUNT):
+    """
+    root에서 limbs개의 chain이 뻗어나가는 joint 계층을 만듭니다. (각 chain 끝에는 End Site)
+    :param rotation_order: 모든 joint의 회전 채널 순서, 'mixed'면 joint마다 ROTATION_ORDERS를 돌아가며 사용
+    :return: [(name, parent index, offset, channels), ...] preorder 리스트 (End Site는 channels가 빈 리스트)
+    """
+    def channels_of(j):
+        order = ROTATION_ORDERS[j % len(ROTATION_ORDERS)] if rotation_order == 'mixed' else rotation_order
+        rotations = [f"{axis}rotation" for axis in order]
+        return ["Xposition", "Yposition", "Zposition"] + rotations if j == 0 else rotations
+
+    chain_lengths = [(num_joints - 1) // limbs + (1 if i < (num_joints - 1) % limbs else 0) for i in range(limbs)]
+    directions = [(0, 1, 0), (0, -1, 0), (1, 0, 0), (-1, 0, 0), (0, 0, 1)]
+    joints = [("Hips", -1, (0.0, 0.0, 0.0), channels_of(0))]
+    for limb, length in enumerate(chain_lengths):
+        parent = 0
+        direction = np.array(directions[limb % len(directions)], dtype=np.float64) * (10.0 + limb)
+        for _ in range(length):
+            j = len(joints)
+            joints.append((f"Joint{j}", parent, tuple(direction), channels_of(j)))
+            parent = j
+        if length:
+            joints.append(("End Site", parent, tuple(direction * 0.5), []))
+    return joints
+
+
+def synthetic_motion_data(joints, frames, start=0, seed=0):
+    """
+    [start, start + frames) 프레임의 motion 채널 값을 만듭니다.
+    root는 앞으로 걸어가며 방향을 천천히 바꾸고, 각 joint는 서로 다른 주기의 sin 곡선으로 회전합니다.
+    :return: (frames, channels) float64 배열
+    """
+    rng = np.random.default_rng(seed)
+    t = (np.arange(start, start + frames, dtype=np.float64) / 30.0)[:, None]
+    columns = []
+    for name, parent, offset, channels in joints:
+        if not channels:
+            continue
+        phase, frequency, amplitude = rng.uniform(0, 2 * np.pi), rng.uniform(0.5, 2.0), rng.uniform(5, 40)
+        for axis_index, channel in enumerate(channels):
+            if channel.endswith('position'):
+                columns.append({'X': 50.0 * t[:, 0], 'Y': 90.0 + 2.0 * np.sin(4 * t[:, 0]),
+                                'Z': 20.0 * np.sin(0.2 * t[:, 0])}[channel[0]])
+            elif parent < 0 and channel[0] == 'Y':
+                columns.append(np.degrees(0.3 * t[:, 0]) % 360.0 - 180.0)
+            else:
+                columns.append(amplitude * np.sin(frequency * t[:, 0] + phase + axis_index))
+    return np.stack(columns, axis=1)
+
+
+def write_synthetic_bvh(path, num_joints=24, frames=1000, rotation_order='ZXY', frame_time=1.0 / 30.0,
+                        seed=0, block_size=65536):
+    """
+    synthetic BVH 파일을 씁니다. MOTION 구간은 block 단위로 만들어 써서 백만 프레임도 메모리에 모두 올리지 않습니다.
+    :param num_joints: End Site를 제외한 joint 수 (root 포함)
+    :param rotation_order: 'ZXY' 같은 회전 채널 순서 또는 'mixed'
+    :return: path
+    """
+    joints = synthetic_hierarchy(num_joints, rotation_order)
+    children = {}
+    for j, (_, parent, _, _) in enumerate(joints):
+        children.setdefault(parent, []).append(j)
+
+    lines = ["HIERARCHY"]
+
+    def write_joint(j, depth):
+        name, parent, offset, channels = joints[j]
+        indent = "\t" * depth
+        offset_text = " ".join(f"{value:.6f}" for value in offset)
+        if not channels:
+            lines.extend([f"{indent}End Site", f"{indent}{{", f"{indent}\tOFFSET {offset_text}", f"{indent}}}"])
+            return
+        lines.append(f"{indent}{'ROOT' if parent < 0 else 'JOINT'} {name}")
+        lines.append(f"{indent}{{")
+        lines.append(f"{indent}\tOFFSET {offset_text}")
+        lines.append(f"{indent}\tCHANNELS {len(channels)} {' '.join(channels)}")
+        for child in children.get(j, []):
+            write_joint(child, depth + 1)
+        lines.append(f"{indent}}}")
+
+    write_joint(0, 0)
+    lines.extend(["MOTION", f"Frames: {frames}", f"Frame Time: {frame_time:.6f}"])
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+        for start in range(0, frames, block_size):
+            data = synthetic_motion_data(joints, min(block_size, frames - start), start, seed)
+            np.savetxt(f, data, fmt='%.4f')
+    return path
+
+
+def _timed(func, repeat=1):
+    # repeat번 실행해 가장 짧은 시간(초)과 마지막 결과를 반환합니다.
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _read_blocks(motion, block_size=BLOCK_SIZE):
+    for start in range(0, motion.frames, block_size):
+        motion.frame_arrays(start, min(start + block_size, motion.frames))
+
+
+def _global_transforms_blocks(motion, skeleton, block_size=BLOCK_SIZE):
+    # 백만 프레임에서도 (F, J, 4, 4) 배열 전체를 만들지 않도록 block 단위로 FK를 계산합니다.
+    for start in range(0, motion.frames, block_size):
+        motion.global_transforms(skeleton, start, min(start + block_size, motion.frames))
+
+
+def _apply_to_skeleton_frames(motion, root, frames):
+    for frame in range(frames):
+        motion.apply_to_skeleton(frame, root)
+
+
+def run_case(path, repeat=1, skeleton_frames=None):
+    """
+    BVH 파일 하나에 대해 단계별 시간(초)을 잽니다.
+    :param skeleton_frames: apply_to_skeleton을 실행할 최대 프레임 수 (None이면 전체 clip)
+    :return: {단계 이름: 초}, apply_to_skeleton은 실제로 실행한 프레임 수도 함께 기록
+    """
+    results = {}
+    results['parse_bvh'], (root, motion) = _timed(lambda: parse_bvh(path, verbose=False), repeat)
+    joint_order = get_preorder_joint_list(root)
+    motion_data = motion.motion_data
+
+    def build():
+        motion.motion_data = motion_data
+        motion.build_quaternion_frames(joint_order)
+    results['build_quaternion_frames'], _ = _timed(build, repeat)
+
+    # apply_virtual은 motion을 제자리에서 바꾸므로 매번 quaternion 배열을 새로 만든 뒤 시간을 잽니다.
+    rotations, positions, has_position, joint_names = (motion.rotations, motion.positions,
+                                                       motion.has_position, motion.joint_names)
+    best = None
+    for _ in range(repeat):
+        motion.rotations, motion.positions = rotations.copy(), positions.copy()
+        motion.has_position = has_position.copy()
+        motion.set_joint_names(joint_names)
+        elapsed, virtual_root = _timed(lambda: motion.apply_virtual(root))
+        best = elapsed if best is None else min(best, elapsed)
+    results['apply_virtual'] = best
+
+    results['skeleton'], skeleton = _timed(lambda: Skeleton(virtual_root), repeat)
+    results['global_transforms'], _ = _timed(lambda: _global_transforms_blocks(motion, skeleton), repeat)
+
+    frames = motion.frames if skeleton_frames is None else min(skeleton_frames, motion.frames)
+    results['apply_to_skeleton'], _ = _timed(lambda: _apply_to_skeleton_frames(motion, virtual_root, frames),
+                                             repeat)
+    results['apply_to_skeleton_frame_count'] = frames
+
+    if motion.frames > 300:
+        # UI의 connect와 같은 방식 (앞 motion의 끝 200프레임, 뒤 motion의 앞 200프레임을 잘라냄)
+        results['connect'], connected = _timed(lambda: connect(motion[:-200], motion[200:]), repeat)
+        results['connect_read'], _ = _timed(lambda: _read_blocks(connected), repeat)
+    return results
+
+
+def case_key(num_joints, rotation_order, frames):
+    return f"j{num_joints}_{rotation_order}_f{frames}"
+
+
+def run_benchmarks(joint_counts, rotation_orders, frame_counts, repeat=1, skeleton_frames=None,
+                   work_dir=None, verbose=True):
+    """
+    모든 (joint 수, 회전 순서, 프레임 수) 조합에 대해 synthetic BVH를 만들고 run_case를 실행합니다.
+    BVH 생성 시간은 결과에 포함하지 않습니다.
+    :return: {'meta': {...}, 'results': {case_key: {단계: 초}}}
+    """
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat,
+        },
+        'results': {}
+    }
+    with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+        for num_joints in joint_counts:
+            for rotation_order in rotation_orders:
+                for frames in frame_counts:
+                    key = case_key(num_joints, rotation_order, frames)
+                    path = os.path.join(temp_dir, key + ".bvh")
+                    if verbose:
+                        print(f"{key}: writing synthetic BVH...", flush=True)
+                    write_synthetic_bvh(path, num_joints, frames, rotation_order)
+                    results = report['results'][key] = run_case(path, repeat, skeleton_frames)
+                    os.remove(path)
+                    if verbose:
+                        print_case(key, results)
+    return report
+
+
+def print_case(key, results):
+    print(key)
+    for stage, seconds in results.items():
+        if stage.endswith('_frame_count'):
+            continue
+        if stage == 'apply_to_skeleton':
+            frames = results['apply_to_skeleton_frame_count']
+            print(f"  {stage:<24} {seconds * 1000:10.1f} ms  ({frames} frames, "
+                  f"{seconds / max(frames, 1) * 1e6:.1f} us/frame)")
+        else:
+            print(f"  {stage:<24} {seconds * 1000:10.1f} ms")
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD, min_seconds=1e-3):
+    """
+    report와 baseline에 모두 있는 (case, 단계)의 시간 비율을 구합니다.
+    :param threshold: 이 비율보다 느려지면 regression으로 봅니다.
+    :param min_seconds: baseline이 이보다 짧은 단계는 측정 잡음이 커서 regression 판정에서 제외합니다.
+    :return: [(case, 단계, baseline 초, 현재 초, 비율, regression 여부), ...]
+    """
+    rows = []
+    for key, results in report['results'].items():
+        old_results = baseline.get('results', {}).get(key)
+        if old_results is None:
+            continue
+        for stage, seconds in results.items():
+            old = old_results.get(stage)
+            if stage.endswith('_frame_count') or old is None or old <= 0:
+                continue
+            if results.get(stage + '_frame_count', 0) != old_results.get(stage + '_frame_count', 0):
+                continue  # 측정한 프레임 수가 다르면 비교하지 않음
+            ratio = seconds / old
+            rows.append((key, stage, old, seconds, ratio, ratio > threshold and old >= min_seconds))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    if not rows:
+        print("No matching cases in baseline.")
+        return
+    print(f"\nCompared with baseline (regression > {threshold:.2f}x):")
+    for key, stage, old, new, ratio, regressed in rows:
+        mark = "  REGRESSION" if regressed else ""
+        print(f"  {key:<20} {stage:<24} {old * 1000:10.1f} -> {new * 1000:10.1f} ms  {ratio:5.2f}x{mark}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="BVH Viewer headless benchmark")
+    parser.add_argument('--joints', type=int, nargs='+', default=[24], help="joint 수 목록 (기본 24)")
+    parser.add_argument('--orders', nargs='+', default=['ZXY'],
+                        help="회전 채널 순서 목록, 'mixed'는 joint마다 다른 순서 (기본 ZXY)")
+    parser.add_argument('--frames', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="프레임 수 목록 (기본 1000 10000 100000, 1000000까지 권장)")
+    parser.add_argument('--repeat', type=int, default=1, help="단계마다 반복 횟수, 가장 짧은 시간을 기록 (기본 1)")
+    parser.add_argument('--skeleton-frames', type=int, default=None,
+                        help="apply_to_skeleton을 실행할 최대 프레임 수 (기본: 전체 clip)")
+    parser.add_argument('--output', default=None, help="결과 JSON 경로")
+    parser.add_argument('--baseline', default=None, help="비교할 baseline JSON 경로")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"regression으로 볼 시간 비율 (기본 {DEFAULT_THRESHOLD})")
+    parser.add_argument('--work-dir', default=None, help="synthetic BVH를 쓸 임시 디렉토리 위치")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args.joints, args.orders, args.frames, args.repeat, args.skeleton_frames,
+                            args.work_dir)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("Results written to", args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.threshold)
+        print_comparison(rows, args.threshold)
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
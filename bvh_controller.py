@@ -1,7 +1,11 @@
 from pyglm import glm
-from virtual_transforms import get_pelvis_virtual, get_pelvis_virtual_safe
+from virtual_transforms import get_pelvis_virtual_batch, euler_to_quat, forward_kinematics, quat_mul, \
+    quat_conjugate, quat_slerp, quat_to_mat3, bone_rotation_batch, AXIS_INDEX
 import math
+import time
+import weakref
 import numpy as np
+from pose_cache import default_pose_cache
 
 def mat4_close(a, b, eps=1e-4):
     for i in range(3):
@@ -31,113 +35,385 @@ class VirtualRootJoint(Joint):
         self.add_child(root)
 
 
+class Skeleton:
+    """
+    FK를 위한 joint topology입니다. get_preorder_joint_list 순서(부모가 항상 자식보다 앞)를 그대로 사용합니다.
+    virtual root가 적용된 motion에는 VirtualRootJoint로 만든 Skeleton을 사용해야 joint 축이 맞습니다.
+    Joint tree는 참조하지 않고 배열은 읽기 전용이므로, 같은 rig의 motion끼리 shared_skeleton으로 하나를 공유해도
+    (여러 thread에서 FK를 돌려도) 서로 영향을 주지 않습니다. pose 결과는 motion마다 별도 배열로 반환됩니다.
+    """
+
+    def __init__(self, root):
+        joints = get_preorder_joint_list(root)
+        self.names = tuple(joint.name for joint in joints)
+        self.channels = tuple(tuple(joint.channels) for joint in joints)
+        index = {id(joint): i for i, joint in enumerate(joints)}
+        self.parents = np.array([index.get(id(joint.parent), -1) for joint in joints], dtype=np.int32)
+        self.offsets = np.array([joint.offset for joint in joints], dtype=np.float32).reshape(-1, 3)
+        self.key = skeleton_key(joints)
+
+        # 뼈(부모 joint -> 자식 joint) 모양은 offset에만 의존하므로 로드할 때 한 번만 계산합니다.
+        self.bone_children = np.flatnonzero(self.parents >= 0)
+        self.bone_joints = self.parents[self.bone_children].astype(np.intp)
+        bone_offsets = self.offsets[self.bone_children].astype(np.float64)
+        self.bone_lengths = np.linalg.norm(bone_offsets, axis=1).astype(np.float32)
+        # 부모 joint 기준으로 뼈 중점으로 이동하고 +y축을 뼈 방향으로 돌리는 행렬
+        frames = np.zeros((len(bone_offsets), 4, 4))
+        # bone_rotation은 뼈 방향 -> +y 회전이므로 역회전(전치)을 사용합니다.
+        frames[:, :3, :3] = quat_to_mat3(quat_conjugate(bone_rotation_batch(bone_offsets)))
+        frames[:, :3, 3] = bone_offsets / 2.0
+        frames[:, 3, 3] = 1.0
+        self.bone_frames = frames.astype(np.float32)
+        for array in (self.parents, self.offsets, self.bone_children, self.bone_joints,
+                      self.bone_lengths, self.bone_frames):
+            array.flags.writeable = False
+        self._bone_locals = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def bone_locals(self, joint_size):
+        """
+        뼈마다 단위 cube([-1, 1])를 뼈 모양 box로 만드는 부모 joint 기준 local 행렬입니다.
+        box의 굵기는 joint_size, 길이는 양 끝 관절 sphere를 뺀 만큼이며, joint_size별로 한 번만 계산합니다.
+        :return: (B, 4, 4) float32 배열 (bone_joints의 global transform에 곱해서 사용)
+        """
+        if joint_size not in self._bone_locals:
+            scale = np.zeros((len(self.bone_lengths), 4))
+            scale[:, 0] = joint_size
+            scale[:, 1] = np.abs(self.bone_lengths - 2 * joint_size) / 2
+            scale[:, 2] = joint_size / 3
+            scale[:, 3] = 1.0
+            bone_locals = (self.bone_frames * scale[:, None, :]).astype(np.float32)
+            bone_locals.flags.writeable = False
+            self._bone_locals[joint_size] = bone_locals
+        return self._bone_locals[joint_size]
+
+
+def skeleton_key(joints):
+    """
+    preorder joint 리스트의 구조(이름, 부모, offset, channel 순서)로 만든 hash 가능한 key입니다.
+    key가 같은 두 joint tree는 같은 Skeleton으로 FK 결과가 같습니다.
+    """
+    index = {id(joint): i for i, joint in enumerate(joints)}
+    return (tuple(joint.name for joint in joints),
+            tuple(index.get(id(joint.parent), -1) for joint in joints),
+            np.array([joint.offset for joint in joints], dtype=np.float32).tobytes(),
+            tuple(tuple(joint.channels) for joint in joints))
+
+
+# skeleton_key -> Skeleton. 사용하는 motion 항목이 모두 사라지면 같이 해제됩니다.
+_shared_skeletons = weakref.WeakValueDictionary()
+
+
+def shared_skeleton(root):
+    """
+    root와 구조가 같은 Skeleton이 이미 있으면 그것을, 없으면 새로 만들어 반환합니다.
+    같은 rig의 clip을 많이 불러와도 topology와 뼈 geometry는 한 벌만 유지됩니다.
+    """
+    key = skeleton_key(get_preorder_joint_list(root))
+    skeleton = _shared_skeletons.get(key)
+    if skeleton is None:
+        skeleton = _shared_skeletons[key] = Skeleton(root)
+    return skeleton
+
+
 class MotionFrame:
     def __init__(self):
         self.joint_rotations = {}
         self.joint_positions = {}
 
 
+class MotionFrameSequence:
+    """
+    Motion 배열을 기존 list[MotionFrame]처럼 접근하기 위한 호환용 view입니다.
+    인덱싱할 때마다 해당 프레임의 MotionFrame을 새로 만들어 반환합니다.
+    """
+
+    def __init__(self, motion):
+        self.motion = motion
+
+    def __len__(self):
+        return self.motion.frames
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.motion.get_frame(i) for i in range(*key.indices(len(self)))]
+        return self.motion.get_frame(key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.motion.get_frame(i)
+
+
 class Motion:
+    """
+    프레임별 joint 회전/위치를 struct-of-arrays로 저장합니다.
+    rotations: (F, J, 4) float32 quaternion (w, x, y, z)
+    positions: (F, J, 3) float32 (has_position[j]가 True인 joint만 의미 있음)
+    joint_names / joint_index: joint 축의 이름 <-> 인덱스 테이블
+    """
+
     def __init__(self, frames, frame_time):
         self.frames = frames
         self.frame_time = frame_time
         self.motion_data = []
-        self.quaternion_frames = []
+        self.joint_names = []
+        self.joint_index = {}
+        self.rotations = np.zeros((0, 0, 4), dtype=np.float32)
+        self.positions = np.zeros((0, 0, 3), dtype=np.float32)
+        self.has_position = np.zeros(0, dtype=bool)
 
     def get_frames(self):
         return self.frames
-    
+
+    @property
+    def quaternion_frames(self):
+        return MotionFrameSequence(self)
+
+    @property
+    def nbytes(self):
+        return self.rotations.nbytes + self.positions.nbytes + self.has_position.nbytes
+
+    def set_joint_names(self, joint_names):
+        self.joint_names = list(joint_names)
+        self.joint_index = {name: i for i, name in enumerate(self.joint_names)}
+
+    def frame_arrays(self, start=None, stop=None):
+        """
+        [start, stop) 프레임의 (rotations, positions) 배열을 반환합니다.
+        모든 프레임 접근은 이 함수를 거치므로 CompositeMotion은 이것만 바꿔서 배열 없이 동작합니다.
+        :return: (F, J, 4), (F, J, 3) 배열 (Motion에서는 복사 없는 view)
+        """
+        return self.rotations[start:stop], self.positions[start:stop]
+
+    def _frame_index(self, frame_index):
+        if frame_index < 0:
+            frame_index += self.frames
+        if not 0 <= frame_index < self.frames:
+            raise IndexError("Motion frame index out of range.")
+        return frame_index
+
+    def get_frame(self, frame_index):
+        """
+        frame_index 프레임을 기존 MotionFrame(dict) 형태로 만들어 반환합니다. (호환용)
+        """
+        frame_index = self._frame_index(frame_index)
+        rotations, positions = self.frame_arrays(frame_index, frame_index + 1)
+        rot_frame = rotations[0].tolist()
+        pos_frame = positions[0].tolist()
+        motion_frame = MotionFrame()
+        for j, name in enumerate(self.joint_names):
+            motion_frame.joint_rotations[name] = glm.quat(*rot_frame[j])
+            if self.has_position[j]:
+                motion_frame.joint_positions[name] = glm.vec3(*pos_frame[j])
+        return motion_frame
+
     def __getitem__(self, key):
         if isinstance(key, slice):
-            new_motion = Motion(0, self.frame_time)
-            new_motion.quaternion_frames = self.quaternion_frames[key]
-            new_motion.frames = len(new_motion.quaternion_frames)
+            # numpy basic slicing이므로 복사 없이 view를 공유합니다.
+            new_motion = Motion.from_arrays(self.joint_names, self.rotations[key], self.positions[key],
+                                            self.has_position, self.frame_time)
+            if isinstance(self.motion_data, np.ndarray):
+                new_motion.motion_data = self.motion_data[key]
             return new_motion
-        elif isinstance(key, int):
-            return self.quaternion_frames[key]
+        elif isinstance(key, (int, np.integer)):
+            return self.get_frame(key)
         else:
             raise TypeError("Motion indices must be integers or slices.")
 
+    @classmethod
+    def from_arrays(cls, joint_names, rotations, positions, has_position, frame_time):
+        """
+        배열을 복사하지 않고 그대로 사용하는 Motion을 만듭니다.
+        """
+        motion = cls(len(rotations), frame_time)
+        motion.set_joint_names(joint_names)
+        motion.rotations = rotations
+        motion.positions = positions
+        motion.has_position = np.asarray(has_position, dtype=bool)
+        return motion
+
+    @classmethod
+    def from_frames(cls, joint_names, motion_frames, frame_time):
+        """
+        list[MotionFrame]을 배열로 모아 Motion을 만듭니다. (호환용)
+        """
+        num_frames, num_joints = len(motion_frames), len(joint_names)
+        rotations = np.zeros((num_frames, num_joints, 4), dtype=np.float32)
+        rotations[..., 0] = 1.0
+        positions = np.zeros((num_frames, num_joints, 3), dtype=np.float32)
+        has_position = np.zeros(num_joints, dtype=bool)
+        for f, frame in enumerate(motion_frames):
+            for j, name in enumerate(joint_names):
+                if name in frame.joint_rotations:
+                    rotations[f, j] = frame.joint_rotations[name].to_list()
+                if name in frame.joint_positions:
+                    positions[f, j] = frame.joint_positions[name].to_list()
+                    has_position[j] = True
+        return cls.from_arrays(joint_names, rotations, positions, has_position, frame_time)
+
     def add_frame_data(self, frame_data):
-        self.motion_data.append(frame_data)
+        if isinstance(self.motion_data, np.ndarray):
+            self.motion_data = np.vstack([self.motion_data, frame_data])
+        else:
+            self.motion_data.append(frame_data)
 
     def build_quaternion_frames(self, joint_order):
-        for frame in self.motion_data:
-            motion_frame = MotionFrame()
-            channel_index = 0
-            for joint in joint_order:
-                num_channels = len(joint.channels)
-                ch_values = frame[channel_index:channel_index + num_channels]
-
-                rotation = glm.vec3(0.0)
-                position = glm.vec3(0.0)
-
-                for i, ch in enumerate(joint.channels):
-                    val = ch_values[i]
-                    if ch.endswith("position"):
-                        if ch == "Xposition": position.x = val
-                        elif ch == "Yposition": position.y = val
-                        elif ch == "Zposition": position.z = val
-                    elif ch.endswith("rotation"):
-                        if ch == "Xrotation": rotation.x = glm.radians(val)
-                        elif ch == "Yrotation": rotation.y = glm.radians(val)
-                        elif ch == "Zrotation": rotation.z = glm.radians(val)
-
-                quat = glm.quat(1, 0, 0, 0)
-                for ch in joint.channels:
-                    if ch.endswith('rotation'):
-                        angle = glm.radians(ch_values[joint.channels.index(ch)])
-                        axis = None
-                        if ch == 'Xrotation':
-                            axis = glm.vec3(1, 0, 0)
-                        elif ch == 'Yrotation':
-                            axis = glm.vec3(0, 1, 0)
-                        elif ch == 'Zrotation':
-                            axis = glm.vec3(0, 0, 1)
-                        quat = quat * glm.angleAxis(angle, axis)
-
-
-                motion_frame.joint_rotations[joint.name] = quat
-                if "position" in ''.join(joint.channels):
-                    motion_frame.joint_positions[joint.name] = position
-
-                channel_index += num_channels
-            self.quaternion_frames.append(motion_frame)
-
-    def apply_virtual(self, root):
+        """
+        motion_data (frames, channels)를 rotation / position 배열로 변환합니다.
+        같은 회전 채널 순서(ZYX, ZXY 등)를 가진 joint들을 모아 전체 프레임을 한 번에 계산합니다.
+        :param joint_order: motion_data 채널 순서와 같은 joint preorder 리스트
+        """
+        motion_data = np.asarray(self.motion_data, dtype=np.float64).reshape(len(self.motion_data), -1)
+        num_frames, num_joints = len(motion_data), len(joint_order)
+        self.set_joint_names([joint.name for joint in joint_order])
+        self.rotations = np.zeros((num_frames, num_joints, 4), dtype=np.float32)
+        self.rotations[..., 0] = 1.0
+        self.positions = np.zeros((num_frames, num_joints, 3), dtype=np.float32)
+        self.has_position = np.array(["position" in ''.join(joint.channels) for joint in joint_order], dtype=bool)
+
+        # 회전 채널 순서별로 (joint 인덱스, motion_data 열 인덱스)를 모읍니다.
+        rotation_groups = {}
+        channel_index = 0
+        for j, joint in enumerate(joint_order):
+            rotation_columns = []
+            rotation_order = ''
+            for i, ch in enumerate(joint.channels):
+                if ch.endswith('position'):
+                    self.positions[:, j, AXIS_INDEX[ch[0]]] = motion_data[:, channel_index + i]
+                elif ch.endswith('rotation'):
+                    rotation_columns.append(channel_index + i)
+                    rotation_order += ch[0]
+            if rotation_order:
+                group = rotation_groups.setdefault(rotation_order, ([], []))
+                group[0].append(j)
+                group[1].append(rotation_columns)
+            channel_index += len(joint.channels)
+
+        for rotation_order, (joint_indices, columns) in rotation_groups.items():
+            angles = np.radians(motion_data[:, columns])  # (F, Jg, len(order))
+            self.rotations[:, joint_indices] = euler_to_quat(angles, rotation_order)
+
+        self.frames = num_frames
+        # 변환이 끝난 float64 채널 배열은 메모리만 차지하고 process pool로 돌려보낼 때도 pickle되므로 버립니다.
+        self.motion_data = []
+
+    def apply_virtual(self, root, smooth_ratio=None):
+        """
+        hip(첫 번째 joint)을 VirtualRoot(global)와 hip(local)으로 분해하고 VirtualRoot 축을 맨 앞에 추가합니다.
+        전체 프레임을 한 번에 계산합니다.
+        :param root: 원본 root joint
+        :param smooth_ratio: None이 아니면 virtual root 회전에 low-pass filter를 적용합니다.
+        :return: VirtualRootJoint
+        """
         vr = VirtualRootJoint(root)
 
-        for frame in self.quaternion_frames:
-            hip_name = next(iter(frame.joint_rotations))
-            ap = frame.joint_positions.get(hip_name, glm.vec3(0))
-            ar = frame.joint_rotations[hip_name]
+        hip = 0
+        ap = self.positions[:, hip].astype(np.float64)
+        ar = self.rotations[:, hip].astype(np.float64)
 
-            ap_local, ar_local = get_pelvis_virtual_safe(ap, ar)
-            ap_global = ap - ap_local
-            ar_global = ar * glm.conjugate(ar_local)
+        ap_local, ar_local = get_pelvis_virtual_batch(ap, ar, smooth_ratio=smooth_ratio)
+        ap_global = ap - ap_local
+        ar_global = quat_mul(ar, quat_conjugate(ar_local))
 
-            frame.joint_positions[hip_name] = ap_local
-            frame.joint_rotations[hip_name] = ar_local
+        self.positions[:, hip] = ap_local
+        self.rotations[:, hip] = ar_local
 
-            frame.joint_positions["VirtualRoot"] = ap_global
-            frame.joint_rotations["VirtualRoot"] = ar_global
+        self.set_joint_names(["VirtualRoot"] + self.joint_names)
+        self.rotations = np.concatenate([ar_global[:, None].astype(np.float32), self.rotations], axis=1)
+        self.positions = np.concatenate([ap_global[:, None].astype(np.float32), self.positions], axis=1)
+        self.has_position = np.concatenate([[True], self.has_position])
+        self.has_position[1] = True
 
         return vr
 
+    def _local_arrays(self, skeleton, start, stop):
+        # local translation = offset + position 채널
+        if len(skeleton) != len(self.joint_names):
+            raise ValueError(f"Skeleton has {len(skeleton)} joints but motion has {len(self.joint_names)}.")
+        rotations, positions = self.frame_arrays(start, stop)
+        return rotations, positions * self.has_position[:, None] + skeleton.offsets
+
+    def global_transforms(self, skeleton, start=0, stop=None):
+        """
+        [start, stop) 프레임 전체의 global joint transform을 한 번에 계산합니다.
+        :param skeleton: motion의 joint 축과 같은 순서의 Skeleton
+        :return: (F, J, 4, 4) float32 배열 (translation은 [..., :3, 3])
+        """
+        return forward_kinematics(*self._local_arrays(skeleton, start, stop), skeleton.parents)
+
+    def global_positions(self, skeleton, start=0, stop=None):
+        """
+        [start, stop) 프레임 전체의 global joint 위치만 계산합니다.
+        :return: (F, J, 3) float32 배열
+        """
+        return forward_kinematics(*self._local_arrays(skeleton, start, stop), skeleton.parents,
+                                  positions_only=True)
+
+    def root_bounds(self, block_size=4096):
+        """
+        전체 프레임에서 VirtualRoot(없으면 첫 번째 joint)가 움직인 영역을 구합니다.
+        CompositeMotion도 block 단위로 읽으므로 전체 배열을 만들지 않습니다.
+        :return: (min xyz, max xyz) float64 배열 튜플, 프레임이 없으면 None
+        """
+        root_index = self.joint_index.get("VirtualRoot", 0)
+        lo = hi = None
+        for start in range(0, self.frames, block_size):
+            _, positions = self.frame_arrays(start, min(start + block_size, self.frames))
+            root = positions[:, root_index]
+            block_lo, block_hi = root.min(axis=0), root.max(axis=0)
+            lo = block_lo if lo is None else np.minimum(lo, block_lo)
+            hi = block_hi if hi is None else np.maximum(hi, block_hi)
+        if lo is None:
+            return None
+        return lo.astype(np.float64), hi.astype(np.float64)
+
+    def get_pose(self, frame_index, skeleton, cache=None):
+        """
+        frame_index 프레임의 global joint transform을 pose cache를 거쳐 반환합니다.
+        :param cache: 사용할 PoseCache (기본값: default_pose_cache)
+        :return: (J, 4, 4) float32 배열 (읽기 전용)
+        """
+        return (cache or default_pose_cache).get(self, frame_index % self.frames, skeleton)
+
+    def interpolated_pose(self, frame_pos, skeleton, cache=None):
+        """
+        실수 프레임 위치의 global joint transform을 반환합니다.
+        이웃한 두 프레임의 local 회전은 slerp, 위치는 lerp로 보간한 뒤 그 한 프레임만 FK를 계산합니다.
+        정수 위치에 가까우면 pose cache를 그대로 사용하고, 마지막 프레임은 첫 프레임과 보간하지 않습니다.
+        :param frame_pos: 실수 프레임 위치
+        :return: (J, 4, 4) float32 배열
+        """
+        frame = int(math.floor(frame_pos))
+        alpha = frame_pos - frame
+        frame %= self.frames
+        if alpha > 1.0 - 1e-3 and frame + 1 < self.frames:
+            frame, alpha = frame + 1, 0.0
+        if alpha < 1e-3 or frame + 1 >= self.frames:
+            return self.get_pose(frame, skeleton, cache)
+        rotations, translations = self._local_arrays(skeleton, frame, frame + 2)
+        rotation = quat_slerp(rotations[0], rotations[1], alpha)
+        translation = translations[0] + (translations[1] - translations[0]) * alpha
+        return forward_kinematics(rotation[None], translation[None], skeleton.parents)[0]
+
     def apply_to_skeleton(self, frame_index: int, joint_root: Joint):
 
-        frame = self.quaternion_frames[frame_index]
+        frame_index = self._frame_index(frame_index)
+        rotations, positions = self.frame_arrays(frame_index, frame_index + 1)
+        rot_frame = rotations[0].tolist()
+        pos_frame = positions[0].tolist()
 
         def apply(joint: Joint):
-            name = joint.name
-            rot = frame.joint_rotations.get(name, glm.quat(1, 0, 0, 0))
+            j = self.joint_index.get(joint.name)
+            rot = glm.quat(*rot_frame[j]) if j is not None else glm.quat(1, 0, 0, 0)
             R = glm.mat4_cast(rot)
 
             offset = glm.vec3(joint.offset)
             T_offset = glm.translate(glm.mat4(1.0), offset)
 
-            if name in frame.joint_positions:
-                T_root = glm.translate(glm.mat4(1.0), frame.joint_positions[name])
+            if j is not None and self.has_position[j]:
+                T_root = glm.translate(glm.mat4(1.0), glm.vec3(*pos_frame[j]))
                 local_transform = T_root * T_offset * R
             else:
                 local_transform = T_offset * R
@@ -150,50 +426,317 @@ class Motion:
         apply(joint_root)
 
 
-def parse_bvh(filename):
+class MotionPart:
+    """
+    CompositeMotion을 이루는 구간입니다. source motion의 [start, stop) 프레임을 복사 없이 참조하고,
+    VirtualRoot에만 root_rotation / root_position offset을 지연 적용합니다.
+    """
+
+    def __init__(self, motion, start, stop, root_rotation=None, root_position=None):
+        self.motion = motion
+        self.start = start
+        self.stop = stop
+        self.root_rotation = root_rotation
+        self.root_position = root_position
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def sub_part(self, start, stop):
+        """
+        part 기준 [start, stop) 구간만 참조하는 MotionPart를 반환합니다.
+        """
+        return MotionPart(self.motion, self.start + start, self.start + stop,
+                          self.root_rotation, self.root_position)
+
+    def with_root_offset(self, root_rotation, root_position):
+        """
+        기존 offset 위에 VirtualRoot offset을 하나 더 적용한 MotionPart를 반환합니다.
+        """
+        if self.root_rotation is not None:
+            root_rotation = quat_mul(root_rotation, self.root_rotation)
+            root_position = root_position + self.root_position
+        return MotionPart(self.motion, self.start, self.stop, root_rotation, root_position)
+
+    def frame_arrays(self, start, stop, root_index):
+        rotations, positions = self.motion.frame_arrays(self.start + start, self.start + stop)
+        if self.root_rotation is None:
+            return rotations, positions
+        rotations = rotations.copy()
+        positions = positions.copy()
+        rotations[:, root_index] = quat_mul(self.root_rotation, rotations[:, root_index])
+        positions[:, root_index] += self.root_position
+        return rotations, positions
+
+
+class BlendPart:
+    """
+    두 MotionPart(part_a -> part_b)를 blending하는 구간입니다. 프레임을 요청받을 때만 slerp/lerp로 계산합니다.
+    blending 비율은 전체 길이 total 중 first번째 프레임부터 시작하는 (k + 1) / (total + 1)입니다. (connect와 같음)
+    """
+
+    def __init__(self, part_a, part_b, has_position, first=0, total=None):
+        self.part_a = part_a
+        self.part_b = part_b
+        self.has_position = has_position
+        self.first = first
+        self.total = len(part_a) if total is None else total
+
+    def __len__(self):
+        return len(self.part_a)
+
+    def sub_part(self, start, stop):
+        return BlendPart(self.part_a.sub_part(start, stop), self.part_b.sub_part(start, stop),
+                         self.has_position, self.first + start, self.total)
+
+    def with_root_offset(self, root_rotation, root_position):
+        return BlendPart(self.part_a.with_root_offset(root_rotation, root_position),
+                         self.part_b.with_root_offset(root_rotation, root_position),
+                         self.has_position, self.first, self.total)
+
+    def frame_arrays(self, start, stop, root_index):
+        rot1, pos1 = self.part_a.frame_arrays(start, stop, root_index)
+        rot2, pos2 = self.part_b.frame_arrays(start, stop, root_index)
+        t = (np.arange(self.first + start, self.first + stop, dtype=np.float32) + 1) / (self.total + 1)
+        rotations = quat_slerp(rot1, rot2, t[:, None]).astype(np.float32)
+        positions = (pos1 + (pos2 - pos1) * t[:, None, None]) * self.has_position[:, None]
+        return rotations, positions.astype(np.float32)
+
+
+class CompositeMotion(Motion):
+    """
+    여러 MotionPart를 이어붙인 Motion입니다. 프레임 데이터를 복사하지 않고,
+    frame_arrays로 요청된 구간만 parts에서 모아 반환합니다.
+    rotations / positions 속성에 접근하면 전체 배열을 만들어 반환하므로 hot path에서는 피해야 합니다.
+    """
+
+    def __init__(self, parts, joint_names, has_position, frame_time):
+        self.frame_time = frame_time
+        self.motion_data = []
+        self.set_joint_names(joint_names)
+        self.has_position = has_position
+        self.parts = [part for part in parts if len(part) > 0]
+        self.part_starts = np.cumsum([0] + [len(part) for part in self.parts])
+        self.frames = int(self.part_starts[-1])
+
+    @property
+    def rotations(self):
+        return self.frame_arrays()[0]
+
+    @property
+    def positions(self):
+        return self.frame_arrays()[1]
+
+    def parts_in_range(self, start=None, stop=None):
+        """
+        [start, stop) 구간과 겹치는 (part, part 기준 start, part 기준 stop, 결과 기준 offset)을 순서대로 반환합니다.
+        """
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        first = max(int(np.searchsorted(self.part_starts, start, side='right')) - 1, 0)
+        for i in range(first, len(self.parts)):
+            part_start = int(self.part_starts[i])
+            if part_start >= stop:
+                break
+            a = max(start, part_start) - part_start
+            b = min(stop, int(self.part_starts[i + 1])) - part_start
+            if b > a:
+                yield self.parts[i], a, b, part_start + a - start
+
+    def frame_arrays(self, start=None, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        root_index = self.joint_index["VirtualRoot"]
+        pieces = list(self.parts_in_range(start, stop))
+        if len(pieces) == 1:
+            part, a, b, _ = pieces[0]
+            return part.frame_arrays(a, b, root_index)
+
+        num_frames = max(stop - start, 0)
+        rotations = np.empty((num_frames, len(self.joint_names), 4), dtype=np.float32)
+        positions = np.empty((num_frames, len(self.joint_names), 3), dtype=np.float32)
+        for part, a, b, dst in pieces:
+            rotations[dst:dst + b - a], positions[dst:dst + b - a] = part.frame_arrays(a, b, root_index)
+        return rotations, positions
+
+    def sub_parts(self, start=None, stop=None):
+        """
+        [start, stop) 구간을 참조하는 MotionPart 리스트를 반환합니다.
+        """
+        return [part.sub_part(a, b) for part, a, b, _ in self.parts_in_range(start, stop)]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in (None, 1):
+            return CompositeMotion(self.sub_parts(key.start, key.stop), self.joint_names,
+                                   self.has_position, self.frame_time)
+        elif isinstance(key, slice):
+            rotations, positions = self.frame_arrays()
+            return Motion.from_arrays(self.joint_names, rotations[key], positions[key],
+                                      self.has_position, self.frame_time)
+        return super().__getitem__(key)
+
+
+def motion_parts(motion, start=None, stop=None):
+    """
+    motion의 [start, stop) 구간을 MotionPart 리스트로 반환합니다. CompositeMotion이면 중첩하지 않고 펼칩니다.
+    """
+    if isinstance(motion, CompositeMotion):
+        return motion.sub_parts(start, stop)
+    start, stop, _ = slice(start, stop).indices(motion.frames)
+    return [MotionPart(motion, start, stop)] if stop > start else []
+
+
+class MotionSequence(CompositeMotion):
+    """
+    여러 motion 구간을 순서대로 이어붙인 timeline입니다.
+    segments: (motion, in, out, transition) 리스트. motion[in:out]을 재생하고,
+    앞 segment의 마지막 transition 프레임과 이 segment의 처음 transition 프레임을 blending합니다. (첫 segment는 무시)
+    source motion은 복사하지 않고 VirtualRoot offset만 지연 적용하며, transition 구간도 요청된 프레임만 계산합니다.
+    segment를 n개 이어도 비용은 segment 수에만 비례합니다. (connect를 반복하면 결과를 매번 다시 펼침)
+    """
+
+    def __init__(self, segments):
+        if not segments:
+            raise ValueError("Motion sequence needs at least one segment.")
+        first_motion = segments[0][0]
+        has_position = first_motion.has_position
+        ranges = []
+        for motion, start, stop, transition in segments:
+            if motion.joint_names != first_motion.joint_names:
+                raise ValueError("Motions have different joints.")
+            if abs(motion.frame_time - first_motion.frame_time) > 1e-6:
+                raise ValueError("Frame times of the motions do not match.")
+            start, stop, _ = slice(start, stop).indices(motion.frames)
+            ranges.append((start, stop))
+            has_position = has_position & motion.has_position
+        transitions = [0] + [segment[3] for segment in segments[1:]] + [0]
+        for i, (start, stop) in enumerate(ranges):
+            if transitions[i] < 0 or transitions[i] + transitions[i + 1] > stop - start:
+                raise ValueError(f"Segment {i} has {stop - start} frames, not enough for its transitions.")
+
+        root_index = first_motion.joint_index["VirtualRoot"]
+        parts = []
+        segment_starts = []
+        num_frames = 0
+        previous = None  # 앞 segment의 root offset까지 적용된 CompositeMotion
+        for i, ((motion, _, _, _), (start, stop)) in enumerate(zip(segments, ranges)):
+            current = CompositeMotion(motion_parts(motion, start, stop), motion.joint_names,
+                                      motion.has_position, motion.frame_time)
+            if previous is not None:
+                # connect와 같이 이 segment의 첫 프레임 VirtualRoot를 앞 segment의 마지막 프레임에 맞춥니다.
+                last_rot, last_pos = previous.frame_arrays(previous.frames - 1, previous.frames)
+                first_rot, first_pos = current.frame_arrays(0, 1)
+                rotation_offset = quat_mul(last_rot[0, root_index], quat_conjugate(first_rot[0, root_index]))
+                position_offset = last_pos[0, root_index] - first_pos[0, root_index]
+                current = CompositeMotion([part.with_root_offset(rotation_offset, position_offset)
+                                           for part in current.parts],
+                                          motion.joint_names, motion.has_position, motion.frame_time)
+            segment_starts.append(num_frames)
+            num_frames += stop - start - transitions[i + 1]
+            if previous is not None and transitions[i]:
+                tail = previous.sub_parts(previous.frames - transitions[i])
+                head = current.sub_parts(0, transitions[i])
+                parts.extend(_blend_parts(tail, head, has_position))
+            parts.extend(current.sub_parts(transitions[i], current.frames - transitions[i + 1]))
+            previous = current
+
+        self.segments = [(motion, start, stop, transition)
+                         for (motion, _, _, transition), (start, stop) in zip(segments, ranges)]
+        self.segment_starts = np.asarray(segment_starts)
+        super().__init__(parts, first_motion.joint_names, has_position, first_motion.frame_time)
+
+    def segment_at(self, frame_index):
+        """
+        frame_index가 속한 segment를 segment 시작 프레임에 대한 binary search로 찾습니다.
+        transition 구간은 뒤 segment에 속한 것으로 봅니다.
+        :return: (segment 번호, segment 기준 프레임 번호 f, 즉 motion[in + f])
+        """
+        frame_index = self._frame_index(frame_index)
+        segment = int(np.searchsorted(self.segment_starts, frame_index, side='right')) - 1
+        return segment, frame_index - int(self.segment_starts[segment])
+
+
+def _blend_parts(parts_a, parts_b, has_position):
+    # 길이가 같은 두 part 리스트를 경계가 맞도록 잘라 BlendPart 리스트로 만듭니다.
+    total = sum(len(part) for part in parts_a)
+    bounds = sorted(set(np.cumsum([0] + [len(part) for part in parts_a]).tolist()) |
+                    set(np.cumsum([0] + [len(part) for part in parts_b]).tolist()))
+    a = CompositeMotion(parts_a, [], has_position, 0.0)
+    b = CompositeMotion(parts_b, [], has_position, 0.0)
+    blended = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        blended.append(BlendPart(a.sub_parts(start, stop)[0], b.sub_parts(start, stop)[0], has_position,
+                                 start, total))
+    return blended
+
+
+def parse_bvh(filename, verbose=True):
+    """
+    BVH 파일을 읽어 joint 계층과 Motion을 반환합니다.
+    HIERARCHY는 줄 단위로 파싱하고, MOTION 구간은 한 번에 (frames, channels) float 배열로 변환합니다.
+    :param filename: BVH 파일 경로
+    :param verbose: 파싱 시간 리포트 출력 여부
+    :return: (root_joint, motion)
+    """
+    start_time = time.perf_counter()
     joints_stack = []
     root_joint = None
     motion = None
+    num_channels = 0
 
     with open(filename, 'r') as file:
-        lines = file.readlines()
-
-    line_iter = iter(lines)
-    for line in line_iter:
-        if 'ROOT' in line or 'JOINT' in line:
-            joint_name = line.strip().split()[1]
-            next(line_iter)
-            offset = [float(x) for x in next(line_iter).strip().split()[1:]]
-            channels = next(line_iter).strip().split()[2:]
-            joint = Joint(joint_name, offset, channels)
-
-            if joints_stack:
-                joints_stack[-1].add_child(joint)
-            else:
-                root_joint = joint
-
-            joints_stack.append(joint)
+        line_iter = iter(file)
+        try:
+            for line in line_iter:
+                if 'ROOT' in line or 'JOINT' in line:
+                    joint_name = line.strip().split()[1]
+                    next(line_iter)
+                    offset = [float(x) for x in next(line_iter).strip().split()[1:]]
+                    channels = next(line_iter).strip().split()[2:]
+                    joint = Joint(joint_name, offset, channels)
+                    num_channels += len(channels)
+
+                    if joints_stack:
+                        joints_stack[-1].add_child(joint)
+                    else:
+                        root_joint = joint
+
+                    joints_stack.append(joint)
+
+                elif 'End Site' in line:
+                    next(line_iter)
+                    offset = [float(x) for x in next(line_iter).strip().split()[1:]]
+                    end_joint = Joint('End Site', offset, [])
+                    joints_stack[-1].add_child(end_joint)
+                    next(line_iter)
+
+                elif '}' in line:
+                    joints_stack.pop()
+
+                elif 'MOTION' in line:
+                    break
+
+            frames = int(next(line_iter).strip().split()[1])
+            frame_time = float(next(line_iter).strip().split()[2])
+        except (StopIteration, IndexError, ValueError):
+            # 파일이 중간에 끊기거나 형식이 다르면 빈 StopIteration 대신 어떤 파일인지 알 수 있게 합니다.
+            raise ValueError(f"{filename}: truncated or malformed BVH header") from None
+        if root_joint is None:
+            raise ValueError(f"{filename}: truncated or malformed BVH header")
+        if frames <= 0:
+            raise ValueError(f"{filename}: BVH has no frames (Frames: {frames}).")
+
+        # 남은 MOTION 구간 전체를 한 번에 (frames, channels) float 배열로 변환 (프레임별 list 생성 X)
+        data = np.loadtxt(file, dtype=np.float64, ndmin=2, max_rows=frames)
+
+    if data.shape != (frames, num_channels):
+        raise ValueError(f"{filename}: expected {frames} frames x {num_channels} channels, "
+                         f"got {data.shape[0]} x {data.shape[1]}.")
 
-        elif 'End Site' in line:
-            next(line_iter)
-            offset = [float(x) for x in next(line_iter).strip().split()[1:]]
-            end_joint = Joint('End Site', offset, [])
-            joints_stack[-1].add_child(end_joint)
-            next(line_iter)
-
-        elif '}' in line:
-            joints_stack.pop()
-
-        elif 'MOTION' in line:
-            break
-
-    frames = int(next(line_iter).strip().split()[1])
-    frame_time = float(next(line_iter).strip().split()[2])
     motion = Motion(frames, frame_time)
+    motion.motion_data = data
 
-    for _ in range(frames):
-        frame_data = [float(val) for val in next(line_iter).strip().split()]
-        motion.add_frame_data(frame_data)
+    elapsed = time.perf_counter() - start_time
+    if verbose:
+        print(f"Parsed {filename}: {frames} frames x {num_channels} channels in {elapsed * 1000:.1f} ms")
 
     return root_joint, motion
 
@@ -210,74 +753,43 @@ def get_preorder_joint_list(root_joint):
     return joint_list
 
 def connect(motion1, motion2, transition_frames=100, start_index_m2=3):
+    """
+    motion1 뒤에 motion2[start_index_m2:]를 이어붙입니다.
+    motion2에는 VirtualRoot offset만 지연 적용하고, transition 구간만 batched slerp/lerp로 새로 계산합니다.
+    나머지 프레임은 두 입력을 복사 없이 공유하므로 비용은 transition 길이에만 비례합니다.
+    :return: CompositeMotion
+    """
     if abs(motion1.frame_time - motion2.frame_time) > 1e-6:
         raise ValueError("Frame times of the two motions do not match.")
     if transition_frames > motion1.get_frames() or transition_frames > (motion2.get_frames() - start_index_m2):
         raise ValueError("Not enough frames to perform blending with the requested transition_frames.")
 
-    new_motion = Motion(0, motion1.frame_time)
+    root_index = motion1.joint_index["VirtualRoot"]
+    num_frames_m1 = motion1.get_frames()
 
     # 1. offset 계산 (VirtualRoot 기준)
-    last_frame_m1 = motion1.quaternion_frames[-1]
-    first_frame_m2 = motion2.quaternion_frames[start_index_m2]
-
-    p1 = last_frame_m1.joint_positions["VirtualRoot"]
-    p2 = first_frame_m2.joint_positions["VirtualRoot"]
-    position_offset = p1 - p2
-
-    r1 = last_frame_m1.joint_rotations["VirtualRoot"]
-    r2 = first_frame_m2.joint_rotations["VirtualRoot"]
-    rotation_offset = r1 * glm.conjugate(r2)
-
-    # 2. motion2 복사본 생성 + VirtualRoot offset 적용
-    adjusted_motion2 = []
-    for frame in motion2.quaternion_frames:
-        new_frame = MotionFrame()
-        for joint_name, quat in frame.joint_rotations.items():
-            if joint_name == "VirtualRoot":
-                new_frame.joint_rotations[joint_name] = rotation_offset * quat
-            else:
-                new_frame.joint_rotations[joint_name] = quat
-
-        for joint_name, pos in frame.joint_positions.items():
-            if joint_name == "VirtualRoot":
-                new_frame.joint_positions[joint_name] = pos + position_offset
-            else:
-                new_frame.joint_positions[joint_name] = pos
-
-        adjusted_motion2.append(new_frame)
-
-    # 3. motion1의 blending 전까지 복사
-    for frame in motion1.quaternion_frames[:-transition_frames]:
-        new_motion.quaternion_frames.append(frame)
-
-    # 4. blending 구간 생성 (offset 이미 적용된 adjusted_motion2 사용)
-    for i in range(transition_frames):
-        t = (i + 1) / (transition_frames + 1)
-        frame1 = motion1.quaternion_frames[-transition_frames + i]
-        frame2 = adjusted_motion2[start_index_m2 + i]
-
-        blended_frame = MotionFrame()
-        joint_names = set(frame1.joint_rotations.keys()) | set(frame2.joint_rotations.keys())
-
-        for joint_name in joint_names:
-            # rotation slerp
-            if joint_name in frame1.joint_rotations and joint_name in frame2.joint_rotations:
-                r1 = frame1.joint_rotations[joint_name]
-                r2 = frame2.joint_rotations[joint_name]
-                blended_frame.joint_rotations[joint_name] = glm.slerp(r1, r2, t)
-
-            # position lerp
-            if joint_name in frame1.joint_positions and joint_name in frame2.joint_positions:
-                p1 = frame1.joint_positions[joint_name]
-                p2 = frame2.joint_positions[joint_name]
-                blended_frame.joint_positions[joint_name] = glm.mix(p1, p2, t)
-
-        new_motion.quaternion_frames.append(blended_frame)
-
-    # 5. motion2 transition 이후 프레임 복사 (offset 적용된 버전에서)
-    for frame in adjusted_motion2[start_index_m2 + transition_frames:]:
-        new_motion.quaternion_frames.append(frame)
-
-    new_motion.frames = len(new_motion.quaternion_frames)
-    return new_motion
+    last_rot_m1, last_pos_m1 = motion1.frame_arrays(num_frames_m1 - 1, num_frames_m1)
+    first_rot_m2, first_pos_m2 = motion2.frame_arrays(start_index_m2, start_index_m2 + 1)
+    position_offset = last_pos_m1[0, root_index] - first_pos_m2[0, root_index]
+    rotation_offset = quat_mul(last_rot_m1[0, root_index], quat_conjugate(first_rot_m2[0, root_index]))
+
+    # 2. motion2는 VirtualRoot offset만 적용한 part로 참조 (복사 X)
+    adjusted_m2 = [part.with_root_offset(rotation_offset, position_offset)
+                   for part in motion_parts(motion2, start_index_m2)]
+    adjusted_m2 = CompositeMotion(adjusted_m2, motion2.joint_names, motion2.has_position, motion2.frame_time)
+
+    # 3. blending 구간만 배열로 계산
+    rot1, pos1 = motion1.frame_arrays(num_frames_m1 - transition_frames, num_frames_m1)
+    rot2, pos2 = adjusted_m2.frame_arrays(0, transition_frames)
+    t = (np.arange(transition_frames, dtype=np.float32) + 1) / (transition_frames + 1)
+    blend_rot = quat_slerp(rot1, rot2, t[:, None]).astype(np.float32)
+    has_position = motion1.has_position & motion2.has_position
+    blend_pos = (pos1 + (pos2 - pos1) * t[:, None, None]) * has_position[:, None]
+    blend = Motion.from_arrays(motion1.joint_names, blend_rot, blend_pos.astype(np.float32),
+                               has_position, motion1.frame_time)
+
+    # 4. motion1의 blending 전까지 + blend + motion2 transition 이후
+    parts = motion_parts(motion1, 0, num_frames_m1 - transition_frames)
+    parts.append(MotionPart(blend, 0, transition_frames))
+    parts.extend(adjusted_m2.sub_parts(transition_frames))
+    return CompositeMotion(parts, motion1.joint_names, has_position, motion1.frame_time)
@@ -0,0 +1,284 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import (BrokenExecutor, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                wait)
+
+import numpy as np
+
+from bvh_controller import get_preorder_joint_list, skeleton_key
+from loader import expand_bvh_paths
+from motion_cache import CACHE_VERSION, load_motion, save_motion
+
+"""
+BVH 라이브러리를 한 번에 변환하는 headless batch 도구입니다.
+디렉토리 아래의 모든 BVH에 parse_bvh -> build_quaternion_frames -> apply_virtual을 process pool에서 실행하고,
+motion cache와 같은 .npz 형식으로 저장한 뒤 manifest.json에 프레임 수, frame_time, joint set, checksum을 기록합니다.
+한 파일의 실패는 그 파일만 manifest에 오류로 남기고, 다시 실행하면 원본이 바뀌지 않은 파일은 건너뜁니다.
+
+    python convert.py bvh/ converted/ --workers 8
+"""
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 2  # 2: joint set id가 이름만이 아니라 skeleton 구조 전체의 hash
+CHECKPOINT_SECONDS = 5.0  # 중간에 중단돼도 이어서 할 수 있도록 manifest를 저장하는 간격
+MAX_CRASH_RETRIES = 1     # worker process가 죽었을 때 같은 파일을 다시 시도할 횟수
+
+
+def file_sha1(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def joint_set_id(key):
+    """
+    skeleton_key(이름, 부모, offset, channel 순서)의 짧은 id입니다. manifest에서 같은 rig의 파일들이 이 id를 공유하며,
+    viewer의 shared_skeleton이 Skeleton 하나를 공유하는 기준과 같습니다.
+    """
+    names, parents, offsets, channels = key
+    digest = hashlib.sha1('\n'.join(names).encode('utf-8'))
+    digest.update(np.array(parents, dtype=np.int32).tobytes())
+    digest.update(offsets)
+    digest.update('\n'.join(' '.join(joint_channels) for joint_channels in channels).encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+def joint_set_info(key):
+    # manifest의 joint_sets에 id마다 한 번 기록하는 skeleton 구조입니다.
+    names, parents, offsets, channels = key
+    return {
+        'names': list(names),
+        'parents': list(parents),
+        'offsets': np.frombuffer(offsets, dtype=np.float32).reshape(-1, 3).tolist(),
+        'channels': [list(joint_channels) for joint_channels in channels],
+    }
+
+
+def output_path(output_dir, rel_path):
+    return os.path.join(output_dir, os.path.splitext(rel_path)[0] + '.npz')
+
+
+def _convert_worker(source, output, compress):
+    # worker process에서 실행되므로 module 최상위 함수여야 pickle이 가능합니다.
+    # 배열은 worker에서 바로 파일로 쓰고, 메인 프로세스에는 manifest에 넣을 값만 돌려줍니다.
+    start_time = time.perf_counter()
+    st = os.stat(source)
+    virtual_root, motion = load_motion(source, use_cache=False, verbose=False)
+    save_motion(output, virtual_root, motion, compress=compress, source_path=os.path.abspath(source),
+                source_meta=np.array([st.st_mtime_ns, st.st_size], dtype=np.int64))
+    return {
+        'frames': motion.frames,
+        'frame_time': motion.frame_time,
+        'skeleton_key': skeleton_key(get_preorder_joint_list(virtual_root)),
+        'source_mtime_ns': st.st_mtime_ns,
+        'source_size': st.st_size,
+        'source_sha1': file_sha1(source),
+        'output_bytes': os.path.getsize(output),
+        'output_sha1': file_sha1(output),
+        'seconds': time.perf_counter() - start_time,
+    }
+
+
+def load_manifest(path):
+    """
+    manifest를 읽습니다. 없거나 읽을 수 없거나 형식이 다르면 빈 manifest를 반환합니다.
+    """
+    empty = {'version': MANIFEST_VERSION, 'format_version': CACHE_VERSION, 'joint_sets': {}, 'files': {}}
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('format_version') != CACHE_VERSION:
+        return empty
+    return manifest
+
+
+def save_manifest(path, manifest):
+    # 임시 파일에 쓴 뒤 교체하므로 저장 중에 중단돼도 이전 manifest가 남습니다.
+    manifest['updated'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(entry, source, output):
+    """
+    manifest 항목이 성공한 변환이고, 원본의 mtime/크기와 출력 파일 크기가 그때와 같으면 True입니다.
+    """
+    if not entry or 'error' in entry or not os.path.exists(output):
+        return False
+    st = os.stat(source)
+    return (entry.get('source_mtime_ns') == st.st_mtime_ns and entry.get('source_size') == st.st_size
+            and entry.get('output_bytes') == os.path.getsize(output))
+
+
+def _make_executor(workers, use_processes):
+    if use_processes:
+        try:
+            return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        except (OSError, NotImplementedError, ValueError) as e:
+            print("Process pool unavailable, using threads:", e)
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+def _retrying(queue, running):
+    # 다음에 제출할 파일이나 실행 중인 파일이 pool 충돌 후 다시 시도하는 파일이면 True입니다.
+    return queue[-1][3] > 0 or any(job[3] > 0 for job in running.values())
+
+
+def convert_library(input_dir, output_dir, workers=None, use_processes=True, force=False, compress=False,
+                    verbose=True):
+    """
+    input_dir 아래의 BVH를 모두 변환해 output_dir에 같은 상대 경로로 저장합니다.
+    :param force: True면 최신인 출력도 다시 변환합니다.
+    :param compress: True면 압축된 .npz로 저장합니다.
+    :return: 요약 dict (converted, skipped, failed, frames, seconds, files_per_second, frames_per_second)
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    old_files = manifest['files']
+    manifest['files'] = {}  # 이번에 찾은 파일만 남겨 지워진 원본의 항목을 정리합니다.
+
+    start_time = time.perf_counter()
+    queue = []
+    skipped = 0
+    for source in expand_bvh_paths([input_dir]):
+        rel_path = os.path.relpath(source, input_dir).replace(os.sep, '/')
+        output = output_path(output_dir, rel_path)
+        entry = old_files.get(rel_path)
+        if not force and is_up_to_date(entry, source, output):
+            manifest['files'][rel_path] = entry
+            skipped += 1
+        else:
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            queue.append((rel_path, source, output, 0))
+    total = len(queue)
+    if verbose:
+        print(f"{total + skipped} BVH files: {total} to convert, {skipped} up to date")
+
+    converted = failed = frames = output_bytes = 0
+    last_checkpoint = time.perf_counter()
+    executor = _make_executor(workers, use_processes)
+    running = {}
+    queue.reverse()  # pop()으로 앞에서부터 꺼냄
+    try:
+        while queue or running:
+            # 메모리에 결과가 쌓이지 않도록 worker 수의 2배까지만 미리 제출합니다.
+            # pool이 깨졌을 때 실행 중이던 파일들은 하나씩 다시 실행해 어느 파일이 원인인지 가려냅니다.
+            while queue and len(running) < (1 if _retrying(queue, running) else 2 * workers):
+                job = queue.pop()
+                running[executor.submit(_convert_worker, job[1], job[2], compress)] = job
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            crashed = []
+            for future in done:
+                rel_path, source, output, attempts = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenExecutor:
+                    crashed.append((rel_path, source, output, attempts))
+                    continue
+                except Exception as e:
+                    failed += 1
+                    error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                    manifest['files'][rel_path] = {'error': error}
+                    print(f"Failed to convert {rel_path}: {error}")
+                    continue
+                key = result.pop('skeleton_key')
+                set_id = joint_set_id(key)
+                if set_id not in manifest['joint_sets']:
+                    manifest['joint_sets'][set_id] = joint_set_info(key)
+                result['joint_set'] = set_id
+                result['output'] = os.path.relpath(output, output_dir).replace(os.sep, '/')
+                manifest['files'][rel_path] = result
+                converted += 1
+                frames += result['frames']
+                output_bytes += result['output_bytes']
+
+            if crashed:
+                # worker 하나가 죽으면 pool 전체가 깨지므로, 실행 중이던 파일들은 새 pool에서 다시 시도합니다.
+                # 혼자 실행했는데도 pool을 깨뜨린 파일만 실패로 기록합니다.
+                crashed.extend(running.values())
+                running.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = _make_executor(workers, use_processes)
+                for rel_path, source, output, attempts in crashed:
+                    if attempts >= MAX_CRASH_RETRIES:
+                        failed += 1
+                        manifest['files'][rel_path] = {'error': "worker process crashed"}
+                        print(f"Failed to convert {rel_path}: worker process crashed")
+                    else:
+                        queue.append((rel_path, source, output, attempts + 1))
+
+            if time.perf_counter() - last_checkpoint > CHECKPOINT_SECONDS:
+                save_manifest(manifest_path, manifest)
+                last_checkpoint = time.perf_counter()
+                if verbose:
+                    elapsed = time.perf_counter() - start_time
+                    print(f"  {converted + failed}/{total} files, {converted / elapsed:.1f} files/s, "
+                          f"{frames / elapsed:.0f} frames/s")
+    finally:
+        # 중단(Ctrl+C 등)돼도 끝난 파일까지는 manifest에 남겨 다음 실행에서 건너뜁니다.
+        executor.shutdown(wait=False, cancel_futures=True)
+        for rel_path, source, output, attempts in list(running.values()) + queue:
+            if rel_path in old_files and rel_path not in manifest['files']:
+                manifest['files'][rel_path] = old_files[rel_path]
+        save_manifest(manifest_path, manifest)
+
+    elapsed = time.perf_counter() - start_time
+    summary = {
+        'converted': converted,
+        'skipped': skipped,
+        'failed': failed,
+        'frames': frames,
+        'output_bytes': output_bytes,
+        'seconds': elapsed,
+        'files_per_second': converted / elapsed if elapsed > 0 else 0.0,
+        'frames_per_second': frames / elapsed if elapsed > 0 else 0.0,
+    }
+    if verbose:
+        print_summary(summary)
+    return summary
+
+
+def print_summary(summary):
+    print(f"Converted {summary['converted']} files ({summary['frames']} frames, "
+          f"{summary['output_bytes'] / 1024 ** 2:.1f} MB), skipped {summary['skipped']}, "
+          f"failed {summary['failed']} in {summary['seconds']:.2f}s")
+    print(f"Throughput: {summary['files_per_second']:.1f} files/s, {summary['frames_per_second']:.0f} frames/s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a BVH library to preprocessed binary motions")
+    parser.add_argument('input_dir', help="BVH 파일을 찾을 디렉토리 (하위 폴더 포함)")
+    parser.add_argument('output_dir', help=f"변환 결과(.npz)와 {MANIFEST_NAME}를 저장할 디렉토리")
+    parser.add_argument('--workers', type=int, default=None, help="worker 수 (기본: CPU 수)")
+    parser.add_argument('--threads', action='store_true', help="process 대신 thread pool 사용")
+    parser.add_argument('--force', action='store_true', help="최신인 출력도 다시 변환")
+    parser.add_argument('--compress', action='store_true', help="압축된 .npz로 저장 (작지만 느림)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.isdir(args.input_dir):
+        print("Not a directory:", args.input_dir)
+        return 2
+    summary = convert_library(args.input_dir, args.output_dir, args.workers, not args.threads,
+                              args.force, args.compress)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import weakref
+
+import numpy as np
+from OpenGL.GL import *
+from pyglm import glm
+
+from Rendering import InstanceBuffer, draw_virtual_root_axis, joint_size
+from virtual_transforms import quat_rotate, extract_xz_plane
+
+"""
+수백 개의 motion을 동시에 미리보기 위한 crowd mode입니다.
+FK 전에 pelvis 중심 bounding sphere로 frustum culling을 하고, 카메라에서 가까운 순서로
+일부만 full detail, 그 다음은 stick figure, 나머지는 점 하나로 그려서 항목이 늘어도 프레임 비용이 거의 일정하게 합니다.
+"""
+
+FULL_DETAIL_DISTANCE = 600.0
+STICK_DISTANCE = 2500.0
+MAX_FULL_DETAIL = 32
+MAX_STICK = 256
+POINT_SIZE = 4.0
+
+
+def frustum_planes(clip):
+    """
+    clip 행렬에서 view frustum의 6개 평면을 구합니다. (Gribb-Hartmann)
+    :param clip: projection @ modelview (4, 4) 행렬 (translation이 [:3, 3]인 보통의 행렬)
+    :return: (6, 4) 정규화된 평면 (a, b, c, d), a*x + b*y + c*z + d >= 0 이면 안쪽
+    """
+    planes = np.stack([clip[3] + clip[0], clip[3] - clip[0],
+                       clip[3] + clip[1], clip[3] - clip[1],
+                       clip[3] + clip[2], clip[3] - clip[2]])
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def current_clip_matrix():
+    """
+    현재 GL projection/modelview 상태로 clip 행렬을 만듭니다. (glGetFloatv는 column-major이므로 전치)
+    """
+    projection = np.asarray(glGetFloatv(GL_PROJECTION_MATRIX), dtype=np.float64).reshape(4, 4).T
+    modelview = np.asarray(glGetFloatv(GL_MODELVIEW_MATRIX), dtype=np.float64).reshape(4, 4).T
+    return projection @ modelview
+
+
+def spheres_in_frustum(planes, centers, radii):
+    """
+    :param centers: (N, 3) bounding sphere 중심
+    :param radii: (N,) 반지름
+    :return: (N,) bool, 조금이라도 frustum 안에 걸치면 True
+    """
+    distances = centers @ planes[:, :3].T + planes[:, 3]
+    return np.all(distances >= -radii[:, None], axis=1)
+
+
+# Skeleton -> (bounding 반지름, stick figure 선분 index)
+_skeleton_info = weakref.WeakKeyDictionary()
+
+
+def skeleton_crowd_info(skeleton):
+    """
+    pelvis(joint 1)에서 가장 먼 joint까지의 뼈 길이 합(bounding sphere 반지름)과
+    stick figure로 그릴 (자식, 부모) joint index 쌍을 skeleton마다 한 번만 계산합니다.
+    """
+    info = _skeleton_info.get(skeleton)
+    if info is None:
+        reach = np.zeros(len(skeleton))
+        lengths = np.linalg.norm(skeleton.offsets, axis=1)
+        for j in range(2, len(skeleton)):
+            reach[j] = reach[skeleton.parents[j]] + lengths[j]
+        children = np.arange(2, len(skeleton))
+        children = children[skeleton.parents[children] >= 1]
+        segments = np.stack([children, skeleton.parents[children]], axis=1).ravel().astype(np.intp)
+        info = (float(reach.max()) + joint_size, segments)
+        _skeleton_info[skeleton] = info
+    return info
+
+
+def pelvis_path(motion, skeleton, block_size=4096):
+    """
+    모든 프레임에서 pelvis의 global 위치를 FK 없이 구합니다.
+    (VirtualRoot의 회전/위치와 pelvis의 local translation만 사용하고, block 단위로 읽습니다)
+    :return: (F, 3) float32 배열
+    """
+    path = np.empty((motion.frames, 3), dtype=np.float32)
+    for start in range(0, motion.frames, block_size):
+        stop = min(start + block_size, motion.frames)
+        rotations, positions = motion.frame_arrays(start, stop)
+        vr_position = positions[:, 0] * motion.has_position[0] + skeleton.offsets[0]
+        pelvis_local = positions[:, 1] * motion.has_position[1] + skeleton.offsets[1]
+        path[start:stop] = vr_position + quat_rotate(rotations[:, 0], pelvis_local)
+    return path
+
+
+class CrowdDrawer:
+    """
+    crowd mode에서 보이는 motion들을 culling/LOD를 거쳐 그립니다.
+    full detail은 SkeletonRenderer에 instance로 넘기고 (flush는 호출하는 쪽에서),
+    stick figure와 점은 재사용 버퍼에 모아 각각 glDrawArrays 한 번으로 그립니다.
+    """
+
+    def __init__(self, renderer, full_distance=FULL_DETAIL_DISTANCE, stick_distance=STICK_DISTANCE,
+                 max_full=MAX_FULL_DETAIL, max_stick=MAX_STICK):
+        self.renderer = renderer
+        self.full_distance = full_distance
+        self.stick_distance = stick_distance
+        self.max_full = max_full
+        self.max_stick = max_stick
+        self.line_vertices = InstanceBuffer((3,))
+        self.line_colors = InstanceBuffer((3,))
+        self.point_vertices = InstanceBuffer((3,))
+        self.point_colors = InstanceBuffer((3,))
+        self._entry_ids = None
+
+    def _prepare(self, entries):
+        # 항목 구성이 바뀔 때만 모든 pelvis 궤적을 하나의 배열로 이어 붙이고 반지름/선분 정보를 모읍니다.
+        entry_ids = [id(entry) for entry in entries]
+        if entry_ids == self._entry_ids:
+            return
+        paths, infos = [], []
+        for entry in entries:
+            path = entry.get('pelvis_path')
+            if path is None or len(path) != entry['motion'].frames:
+                path = entry['pelvis_path'] = pelvis_path(entry['motion'], entry['skeleton'])
+            paths.append(path)
+            infos.append(skeleton_crowd_info(entry['skeleton']))
+        self._entry_ids = entry_ids
+        self._lengths = np.array([len(path) for path in paths], dtype=np.int64)
+        self._offsets = np.concatenate([[0], np.cumsum(self._lengths)[:-1]])
+        self._paths = np.concatenate(paths)
+        self._radii = np.array([radius for radius, _ in infos])
+        self._segments = [segments for _, segments in infos]
+
+    def pelvis_centers(self, entries):
+        """
+        각 항목의 현재 프레임 pelvis 위치를 한 번의 gather로 구합니다.
+        :return: (N, 3) float32 배열
+        """
+        self._prepare(entries)
+        frames = np.fromiter((entry['frame_idx'] for entry in entries), dtype=np.int64, count=len(entries))
+        return self._paths[self._offsets + frames % self._lengths]
+
+    def draw(self, entries, eye, clip=None):
+        """
+        :param entries: 그릴 (visible) motion 항목 리스트
+        :param eye: 카메라 위치 (glm.vec3)
+        :param clip: projection @ modelview 행렬 (None이면 현재 GL 상태에서 읽음)
+        :return: dict(total, culled, full, stick, points)
+        """
+        stats = {'total': len(entries), 'culled': 0, 'full': 0, 'stick': 0, 'points': 0}
+        if not entries:
+            return stats
+        centers = self.pelvis_centers(entries)
+        planes = frustum_planes(current_clip_matrix() if clip is None else clip)
+        visible = np.flatnonzero(spheres_in_frustum(planes, centers, self._radii))
+        stats['culled'] = len(entries) - len(visible)
+
+        # 가까운 순서로 full -> stick -> point. 개수 상한이 있어 항목이 늘어도 비싼 LOD의 수는 일정합니다.
+        distances = np.linalg.norm(centers[visible] - np.array([eye.x, eye.y, eye.z]), axis=1)
+        order = visible[np.argsort(distances)]
+        distances = np.sort(distances)
+        num_full = min(self.max_full, int(np.searchsorted(distances, self.full_distance)))
+        num_stick = min(self.max_stick, int(np.searchsorted(distances, self.stick_distance)) - num_full)
+        full, stick, points = order[:num_full], order[num_full:num_full + num_stick], order[num_full + num_stick:]
+
+        for i in full.tolist():
+            entry = entries[i]
+            pose = entry['motion'].get_pose(entry['frame_idx'], entry['skeleton'])
+            self.renderer.add(entry['skeleton'], pose, entry['color'])
+            draw_virtual_root_axis(extract_xz_plane(glm.mat4(pose[1])), entry['color'])
+        self._draw_sticks([entries[i] for i in stick.tolist()], [self._segments[i] for i in stick.tolist()])
+        self._draw_points(centers[points], [entries[i]['color'] for i in points.tolist()])
+
+        stats.update(full=len(full), stick=len(stick), points=len(points))
+        return stats
+
+    def _draw_sticks(self, entries, segments):
+        count = sum(len(index) for index in segments)
+        if not count:
+            return
+        vertices = self.line_vertices.reserve(count)
+        colors = self.line_colors.reserve(count)
+        start = 0
+        for entry, index in zip(entries, segments):
+            pose = entry['motion'].get_pose(entry['frame_idx'], entry['skeleton'])
+            stop = start + len(index)
+            np.take(pose[:, :3, 3], index, axis=0, out=vertices[start:stop], mode='clip')
+            colors[start:stop] = entry['color']
+            start = stop
+        _draw_client_arrays(GL_LINES, vertices[:count], colors[:count])
+
+    def _draw_points(self, centers, colors):
+        if not len(centers):
+            return
+        vertices = self.point_vertices.reserve(len(centers))
+        point_colors = self.point_colors.reserve(len(centers))
+        vertices[:len(centers)] = centers
+        point_colors[:len(centers)] = colors
+        glPushAttrib(GL_POINT_BIT)
+        glPointSize(POINT_SIZE)
+        _draw_client_arrays(GL_POINTS, vertices[:len(centers)], point_colors[:len(centers)])
+        glPopAttrib()
+
+
+def _draw_client_arrays(mode, vertices, colors):
+    # 조명 없이 단색 선/점을 client-side vertex array로 한 번에 그립니다.
+    glPushAttrib(GL_ENABLE_BIT)
+    glDisable(GL_LIGHTING)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_COLOR_ARRAY)
+    glVertexPointer(3, GL_FLOAT, 0, vertices)
+    glColorPointer(3, GL_FLOAT, 0, colors)
+    glDrawArrays(mode, 0, len(vertices))
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glPopAttrib()
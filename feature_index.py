@@ -0,0 +1,246 @@
+import time
+from collections import deque
+
+import numpy as np
+
+from motion_features import matching_features, TRAJECTORY_OFFSETS
+
+"""
+여러 clip의 모든 프레임에서 주어진 pose/trajectory와 가장 비슷한 프레임을 찾는 motion matching용 feature index입니다.
+feature는 그룹별로 정규화해 하나의 연속 배열에 저장하고, 주성분 몇 개로 만든 Morton(Z-order) 코드 순서로 정렬해
+가까운 프레임끼리 모이게 합니다. 정렬된 배열을 leaf(16행)와 group(leaf 32개)의 bounding box로 나눠
+box 거리의 하한으로 탐색 범위를 줄이므로 결과는 brute force와 같습니다.
+새로 추가된 프레임은 정렬되지 않은 tail에 두고 brute force로 찾다가, tail이 커지면 전체를 다시 정렬합니다.
+"""
+
+LEAF_SIZE = 16
+GROUP_LEAVES = 32
+CODE_COMPONENTS = 4  # Morton 코드를 만들 주성분 수
+CODE_BITS = 12       # 주성분 하나당 양자화 bit 수
+MIN_TAIL = 1024      # tail이 이 크기와 (정렬된 행 수 / 32) 중 큰 값을 넘으면 다시 정렬
+BLOCK_SIZE = 256
+UPDATE_BUDGET = 0.004  # 메인 루프 한 프레임에서 feature 추출에 쓸 최대 시간(초)
+GROUP_WEIGHTS = (1.0, 1.0, 1.0, 1.0, 1.0)  # 위치, 속도, root 속도, future 위치, future 방향
+
+
+def box_distances(query, lo, hi):
+    """
+    query에서 각 box (lo, hi)까지의 제곱 거리 (box 안 점들과의 거리의 하한)를 반환합니다.
+    """
+    return np.square(query - np.clip(query, lo, hi)).sum(axis=1)
+
+
+def morton_codes(points, lo, hi, bits=CODE_BITS):
+    """
+    (N, K) 점들을 [lo, hi] 범위에서 bits bit로 양자화하고 축별 bit를 번갈아 이어붙인 Morton 코드를 만듭니다.
+    """
+    levels = (1 << bits) - 1
+    quantized = (np.clip((points - lo) / np.maximum(hi - lo, 1e-9), 0.0, 1.0) * levels).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    one = np.uint64(1)
+    for bit in range(bits - 1, -1, -1):
+        for axis in range(points.shape[1]):
+            codes = (codes << one) | ((quantized[:, axis] >> np.uint64(bit)) & one)
+    return codes
+
+
+def _box_bounds(lo_rows, hi_rows, size):
+    # rows를 size개씩 묶은 box의 (lo, hi)를 구합니다. 마지막 box는 마지막 행을 반복해서 채웁니다.
+    pad = -len(lo_rows) % size
+    lo = np.pad(lo_rows, ((0, pad), (0, 0)), mode='edge').reshape(-1, size, lo_rows.shape[1]).min(axis=1)
+    hi = np.pad(hi_rows, ((0, pad), (0, 0)), mode='edge').reshape(-1, size, hi_rows.shape[1]).max(axis=1)
+    return lo, hi
+
+
+def _grow(array, count):
+    # count 행이 들어가도록 첫 축을 최소 2배씩 늘린 배열을 반환합니다.
+    if count <= len(array):
+        return array
+    grown = np.empty((max(count, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class FeatureIndex:
+    """
+    사용법:
+        index.add(key, motion, skeleton)  # 프레임 feature 추출은 update()에서 block 단위로 진행
+        index.update()                    # 메인 루프에서 매 프레임 호출
+        key, frame, distance = index.nearest(features)
+    모든 clip은 같은 feature 차원(같은 end effector 수)이어야 합니다.
+    """
+
+    def __init__(self, offsets=TRAJECTORY_OFFSETS, group_weights=GROUP_WEIGHTS, block_size=BLOCK_SIZE):
+        self.offsets = offsets
+        self.group_weights = group_weights
+        self.block_size = block_size
+        self.keys = []
+        self.pending = deque()  # [clip id, motion, skeleton, 다음에 추출할 프레임]
+        self.count = 0
+        self.sorted_count = 0
+        self.dim = None
+        self.groups = None
+        self._normalized_count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def busy(self):
+        return bool(self.pending)
+
+    def add(self, key, motion, skeleton):
+        """
+        clip을 index에 추가하도록 예약합니다. 실제 feature 추출은 update()에서 진행됩니다.
+        :param key: nearest()가 돌려줄 clip 식별자 (예: state['motions']의 항목)
+        """
+        self.keys.append(key)
+        self.pending.append([len(self.keys) - 1, motion, skeleton, 0])
+
+    def update(self, budget=UPDATE_BUDGET):
+        """
+        예약된 clip들의 feature를 budget 초 동안 block 단위로 추출해 index에 넣습니다.
+        :param budget: None이면 예약된 clip을 모두 처리합니다.
+        :return: 이번에 추가된 프레임 수
+        """
+        start_time = time.perf_counter()
+        added = 0
+        while self.pending and (budget is None or time.perf_counter() - start_time < budget):
+            job = self.pending[0]
+            clip_id, motion, skeleton, start = job
+            stop = min(start + self.block_size, motion.frames)
+            try:
+                features, groups = matching_features(motion, skeleton, start, stop, self.offsets)
+                self._insert(features, groups, clip_id, start)
+            except ValueError as e:
+                print("Cannot index motion:", e)
+                self.pending.popleft()
+                continue
+            added += stop - start
+            job[3] = stop
+            if stop >= motion.frames:
+                self.pending.popleft()
+        return added
+
+    def _insert(self, features, groups, clip_id, first_frame):
+        if self.dim is None:
+            self.dim, self.groups = features.shape[1], groups
+            self.raw = np.empty((BLOCK_SIZE, self.dim), dtype=np.float32)
+            self.features = np.empty((BLOCK_SIZE, self.dim), dtype=np.float32)
+            self.codes = np.empty(BLOCK_SIZE, dtype=np.uint64)
+            self.clip_ids = np.empty(BLOCK_SIZE, dtype=np.int32)
+            self.frames = np.empty(BLOCK_SIZE, dtype=np.int32)
+            self._sum = np.zeros(self.dim)
+            self._sum_sq = np.zeros(self.dim)
+        elif features.shape[1] != self.dim:
+            raise ValueError(f"feature dimension {features.shape[1]} does not match index dimension {self.dim}.")
+
+        start, stop = self.count, self.count + len(features)
+        self.raw, self.features, self.codes, self.clip_ids, self.frames = (
+            _grow(array, stop) for array in (self.raw, self.features, self.codes, self.clip_ids, self.frames))
+        self.raw[start:stop] = features
+        self.clip_ids[start:stop] = clip_id
+        self.frames[start:stop] = np.arange(first_frame, first_frame + len(features))
+        self._sum += features.sum(axis=0)
+        self._sum_sq += np.square(features, dtype=np.float64).sum(axis=0)
+        self.count = stop
+
+        if self.count >= 2 * self._normalized_count:
+            # 정규화 값과 Morton 코드 축은 프레임 수가 두 배가 될 때마다 다시 구합니다. (amortized O(1))
+            self._update_normalization()
+            self._normalized_count = self.count
+            start = 0
+        self.features[start:stop] = self.normalize(self.raw[start:stop])
+        self.codes[start:stop] = morton_codes(self.features[start:stop] @ self.axes, self.code_lo, self.code_hi)
+        if start == 0 or self.count - self.sorted_count > max(MIN_TAIL, self.sorted_count // 32):
+            self._sort()
+
+    def _update_normalization(self):
+        # feature 그룹마다 평균 표준편차로 나눠 그룹 간 크기를 맞추고 group_weights를 곱합니다.
+        mean = self._sum / self.count
+        std = np.sqrt(np.maximum(self._sum_sq / self.count - np.square(mean), 0.0))
+        scale = np.empty(self.dim)
+        offset = 0
+        for size, weight in zip(self.groups, self.group_weights):
+            scale[offset:offset + size] = weight / max(std[offset:offset + size].mean(), 1e-6)
+            offset += size
+        self.mean = mean.astype(np.float32)
+        self.scale = scale.astype(np.float32)
+
+        # 정규화된 feature의 주성분 축과 그 범위를 Morton 코드에 사용합니다. (최대 4096행 표본)
+        sample = self.normalize(self.raw[:self.count:max(self.count // 4096, 1)])
+        _, _, vt = np.linalg.svd(sample - sample.mean(axis=0), full_matrices=False)
+        self.axes = np.ascontiguousarray(vt[:CODE_COMPONENTS].T)
+        projected = sample @ self.axes
+        self.code_lo, self.code_hi = projected.min(axis=0), projected.max(axis=0)
+
+    def normalize(self, features):
+        return (features - self.mean) * self.scale
+
+    def _sort(self):
+        # 모든 행을 Morton 코드 순서로 정렬하고 leaf/group box를 다시 만듭니다.
+        # 정렬된 앞부분 + 정렬된 tail이라 stable sort(timsort)는 거의 병합 비용만 듭니다.
+        order = np.argsort(self.codes[:self.count], kind='stable')
+        for name in ('raw', 'features', 'codes', 'clip_ids', 'frames'):
+            array = getattr(self, name)
+            array[:self.count] = array[:self.count][order]
+        self.sorted_count = self.count
+        features = self.features[:self.count]
+        self.leaf_lo, self.leaf_hi = _box_bounds(features, features, LEAF_SIZE)
+        self.group_lo, self.group_hi = _box_bounds(self.leaf_lo, self.leaf_hi, GROUP_LEAVES)
+
+    def nearest(self, features, exclude=None):
+        """
+        정규화 전 feature 한 개와 가장 가까운 프레임을 찾습니다.
+        tail은 brute force로, 정렬된 부분은 group -> leaf 순서로 하한이 지금까지의 최소 거리보다 작은 box만 확인합니다.
+        :param features: (D,) matching_features와 같은 형식의 feature
+        :param exclude: 결과에서 뺄 clip key (예: query를 만든 clip 자신)
+        :return: (key, 프레임 번호, 거리) 또는 찾을 프레임이 없으면 None
+        """
+        if not self.count:
+            return None
+        query = self.normalize(np.asarray(features, dtype=np.float32).reshape(self.dim))
+        excluded = None
+        if exclude is not None:
+            excluded = np.array([key is exclude for key in self.keys])
+
+        best, best_row = np.inf, -1
+        if self.count > self.sorted_count:
+            best, best_row = self._nearest_rows(query, slice(self.sorted_count, self.count), excluded,
+                                                best, best_row)
+        num_leaves = len(self.leaf_lo)
+        group_distances = box_distances(query, self.group_lo, self.group_hi)
+        leaf_rows = np.arange(LEAF_SIZE)
+        for group in np.argsort(group_distances).tolist():
+            if group_distances[group] >= best:
+                break
+            first_leaf = group * GROUP_LEAVES
+            last_leaf = min(first_leaf + GROUP_LEAVES, num_leaves)
+            leaf_distances = box_distances(query, self.leaf_lo[first_leaf:last_leaf],
+                                           self.leaf_hi[first_leaf:last_leaf])
+            leaves = np.flatnonzero(leaf_distances < best) + first_leaf
+            if not len(leaves):
+                continue
+            rows = (leaves[:, None] * LEAF_SIZE + leaf_rows).ravel()
+            best, best_row = self._nearest_rows(query, rows[rows < self.sorted_count], excluded, best, best_row)
+
+        if best_row < 0:
+            return None
+        return self.keys[self.clip_ids[best_row]], int(self.frames[best_row]), float(np.sqrt(best))
+
+    def _nearest_rows(self, query, rows, excluded, best, best_row):
+        # rows(slice 또는 행 번호 배열) 중 best보다 가까운 행이 있으면 (거리, 행)을 갱신합니다.
+        distances = np.square(self.features[rows] - query).sum(axis=1)
+        if excluded is not None:
+            distances[excluded[self.clip_ids[rows]]] = np.inf
+        i = int(np.argmin(distances))
+        if distances[i] < best:
+            return float(distances[i]), rows.start + i if isinstance(rows, slice) else int(rows[i])
+        return best, best_row
+
+    def nearest_to_frame(self, motion, skeleton, frame, exclude=None):
+        """
+        motion의 frame 프레임과 가장 비슷한 프레임을 index에서 찾습니다.
+        """
+        features, _ = matching_features(motion, skeleton, frame, frame + 1, self.offsets)
+        return self.nearest(features[0], exclude)
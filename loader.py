@@ -0,0 +1,144 @@
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from motion_cache import MotionCache, load_motion
+
+"""
+BVH 로딩(parse_bvh -> build_quaternion_frames -> apply_virtual)을 worker pool에서 실행해
+렌더 루프가 멈추지 않게 하기 위한 모듈입니다.
+"""
+
+
+def _load_worker(file_path, use_cache, cache_dir):
+    # worker process에서 실행되므로 module 최상위 함수여야 pickle이 가능합니다.
+    cache = MotionCache(cache_dir) if cache_dir else None
+    return load_motion(file_path, use_cache=use_cache, cache=cache, verbose=False)
+
+
+def expand_bvh_paths(patterns):
+    """
+    파일, 디렉토리(하위 폴더 포함), glob 패턴을 BVH 파일 경로 리스트로 펼칩니다.
+    :param patterns: 경로 또는 glob 패턴 리스트
+    :return: 중복 없이 입력 순서를 유지한 BVH 파일 경로 리스트
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for dir_path, _, file_names in os.walk(pattern):
+                paths.extend(os.path.join(dir_path, name) for name in sorted(file_names)
+                             if name.lower().endswith('.bvh'))
+        elif os.path.isfile(pattern):
+            paths.append(pattern)
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if not matches:
+                print("No BVH files match:", pattern)
+            paths.extend(path for path in matches if os.path.isfile(path))
+    return list(dict.fromkeys(paths))
+
+
+class PendingLoad:
+    def __init__(self, file_path, future):
+        self.file_path = file_path
+        self.name = os.path.basename(file_path)
+        self.future = future
+        self.submitted = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.submitted
+
+
+class MotionLoader:
+    """
+    BVH 파일을 백그라운드에서 로드합니다.
+    기본은 process pool이라 파싱이 GIL을 우회하고, 여러 파일을 동시에 요청하면 병렬로 로드됩니다.
+    완료된 결과는 poll()을 호출하는 쪽(메인 루프)에서 프레임 사이에 가져갑니다.
+    """
+
+    def __init__(self, max_workers=None, use_processes=True, use_cache=True, cache_dir=None):
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.pending = []
+        self.completed = 0
+        self.failed = 0
+        self.max_workers = max_workers
+        self.executor = None
+        if use_processes:
+            try:
+                # 렌더링 중인 프로세스를 fork하지 않도록 spawn을 사용합니다.
+                self.executor = ProcessPoolExecutor(max_workers=max_workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            except (OSError, NotImplementedError, ValueError):
+                self.executor = None
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _fallback_to_threads(self):
+        # process pool을 쓸 수 없는 환경이면 thread pool로 전환합니다.
+        if not isinstance(self.executor, ThreadPoolExecutor):
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, file_path):
+        """
+        file_path 로딩을 worker pool에 요청합니다.
+        """
+        try:
+            future = self.executor.submit(_load_worker, file_path, self.use_cache, self.cache_dir)
+        except BrokenExecutor:
+            self._fallback_to_threads()
+            future = self.executor.submit(_load_worker, file_path, self.use_cache, self.cache_dir)
+        self.pending.append(PendingLoad(file_path, future))
+
+    def submit_many(self, file_paths):
+        for file_path in file_paths:
+            self.submit(file_path)
+
+    @property
+    def busy(self):
+        return bool(self.pending)
+
+    def progress(self):
+        """
+        :return: (완료된 수, 지금까지 요청된 전체 수)
+        """
+        done = self.completed + self.failed
+        return done, done + len(self.pending)
+
+    def poll(self):
+        """
+        완료된 로딩 결과를 요청 순서와 관계없이 꺼내 반환합니다. 실패한 파일은 출력만 하고 건너뜁니다.
+        :return: [(file_path, virtual_root, motion), ...]
+        """
+        results = []
+        still_pending = []
+        retry = []
+        for pending in self.pending:
+            if not pending.future.done():
+                still_pending.append(pending)
+                continue
+            try:
+                virtual_root, motion = pending.future.result()
+            except BrokenExecutor:
+                retry.append(pending.file_path)
+                continue
+            except Exception as e:
+                self.failed += 1
+                print("Failed to load:", pending.file_path, e)
+                continue
+            self.completed += 1
+            results.append((pending.file_path, virtual_root, motion))
+        self.pending = still_pending
+        if retry:
+            self._fallback_to_threads()
+            self.submit_many(retry)
+        if not self.pending:
+            self.completed = self.failed = 0
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,9 @@
 import tkinter as tk
-tk.Tk().withdraw()
+import argparse
 import math
+import os
+import time
+import numpy as np
 import pygame
 from OpenGL.GL import *
 from OpenGL.GLU import *
@@ -8,9 +11,13 @@ import imgui
 from imgui.integrations.pygame import PygameRenderer
 from pyglm import glm
 
-from bvh_controller import parse_bvh, get_preorder_joint_list
-from Rendering import draw_humanoid, draw_virtual_root_axis
-from utils import draw_axes, set_lights, random_color
+from bvh_controller import shared_skeleton
+from crowd import CrowdDrawer
+from loader import MotionLoader, expand_bvh_paths
+from playback import PlaybackClock, advance_entry
+from profiler import FrameProfiler
+from Rendering import SkeletonRenderer, draw_virtual_root_axis
+from utils import draw_axes, grid_extent, set_lights, random_color
 from virtual_transforms import extract_xz_plane
 import Events
 import UI
@@ -27,13 +34,36 @@ state = {
     'is_rotating': False,
     'is_translating': False,
     'stop': False,
+    # 재생 속도 배율 (--rate). 재생 위치는 wall time과 각 motion의 frame_time으로 정해집니다.
+    'playback_rate': 1.0,
+    # 프레임 사이 pose를 slerp로 보간할지 여부 (--no-interp)
+    'interpolate': True,
     # motions: 파일 로더를 통해 추가된 여러 BVH 모션 정보 목록
-    # 각 항목은 'name', 'root', 'motion', 'frame_len', 'visible', 'frame_idx'를 포함합니다.
+    # 각 항목은 'name', 'skeleton', 'motion', 'frame_len', 'visible', 'frame_idx', 'time'을 포함합니다.
     'motions': [],
     # 파일 다이얼로그 호출 플래그 (파일 로더 창에서 사용)
-    'open_file_dialog': False
+    'open_file_dialog': False,
+    # 백그라운드 BVH 로더 (main()에서 생성)
+    'loader': None,
+    # skeleton instancing renderer (main()에서 생성)
+    'renderer': None,
+    # crowd mode: frustum culling + 거리별 LOD로 많은 motion을 동시에 그림 (--crowd)
+    'crowd_mode': False,
+    'crowd_stats': None,
+    # 단계별 frame profiler (main()에서 생성)와 HUD 표시 여부 (--profile, F3)
+    'profiler': None,
+    'show_profiler': False,
+    # motion matching feature index. 첫 "Find Best Match" 때 그때까지의 motion으로 만들고 (UI.draw_matching_section),
+    # 이후에는 로드되는 clip을 추가합니다. feature 추출은 프레임 사이에 조금씩 진행됩니다.
+    'feature_index': None,
+    # 일시정지 중 다시 그려야 할 남은 프레임 수 (Events.request_redraw로 설정)
+    'redraw_frames': Events.REDRAW_FRAMES
 }
 
+# 일시정지 후 바뀐 것이 없을 때 event를 기다리는 최대 시간 (백그라운드 로딩 결과 확인 주기)
+IDLE_WAIT_MS = 250
+
+
 def resize(width, height):
     glViewport(0, 0, width - 300, height - 200)  # side panel과 control panel만큼 영역 축소
     glMatrixMode(GL_PROJECTION)
@@ -42,27 +72,143 @@ def resize(width, height):
     glMatrixMode(GL_MODELVIEW)
 
 
-def main():
+def scene_bounds(motions):
+    """
+    로드된 모든 motion의 VirtualRoot 이동 영역을 합친 bounding box를 반환합니다.
+    motion별 결과는 항목의 'bounds'에, 합친 결과는 motion 수가 바뀔 때까지 state에 저장합니다.
+    :return: (min xyz, max xyz) 또는 motion이 없으면 None
+    """
+    cached = state.get('scene_bounds')
+    if cached is not None and cached[0] == len(motions):
+        return cached[1]
+    lo = hi = None
+    for motion_entry in motions:
+        if 'bounds' not in motion_entry:
+            motion_entry['bounds'] = motion_entry['motion'].root_bounds()
+        if motion_entry['bounds'] is None:
+            continue
+        entry_lo, entry_hi = motion_entry['bounds']
+        lo = entry_lo if lo is None else np.minimum(lo, entry_lo)
+        hi = entry_hi if hi is None else np.maximum(hi, entry_hi)
+    bounds = None if lo is None else (lo, hi)
+    state['scene_bounds'] = (len(motions), bounds)
+    return bounds
+
+
+def add_motion_entry(file_path, virtual_root, motion):
+    """
+    로드가 끝난 motion을 state['motions']에 추가합니다. 메인 루프의 프레임 사이에서만 호출합니다.
+    """
+    new_entry = {
+        'name': os.path.basename(file_path),
+        # 같은 rig의 motion들은 읽기 전용 Skeleton 하나를 공유합니다. (Joint tree는 보관하지 않음)
+        'skeleton': shared_skeleton(virtual_root),
+        'motion': motion,
+        'frame_len': motion.frames,
+        'visible': True,
+        'frame_idx': 0,
+        'time': 0.0,
+        'color': random_color()
+    }
+    state['motions'].append(new_entry)
+    if state['feature_index'] is not None:
+        state['feature_index'].add(new_entry, motion, new_entry['skeleton'])
+    Events.request_redraw(state)
+    print("File loaded:", file_path)
+
+
+def needs_render():
+    """
+    재생 중이거나, 다시 그리기가 요청됐거나, 로딩 진행 상황을 보여줘야 하면 True입니다.
+    """
+    return not state['stop'] or state['redraw_frames'] > 0 or state['loader'].busy
+
+
+def wait_events():
+    """
+    대기 중인 event를 모두 가져옵니다. 그릴 것이 없으면 다음 event가 올 때까지 (최대 IDLE_WAIT_MS) 잠듭니다.
+    feature index에 추가할 프레임이 남아 있으면 잠들지 않습니다.
+    """
+    events = pygame.event.get()
+    index = state['feature_index']
+    if events or needs_render() or (index is not None and index.busy):
+        return events
+    event = pygame.event.wait(IDLE_WAIT_MS)
+    if event.type == pygame.NOEVENT:
+        return []
+    return [event] + pygame.event.get()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="BVH Viewer")
+    parser.add_argument('paths', nargs='*',
+                        help="시작할 때 로드할 BVH 파일, 디렉토리 또는 glob 패턴 (예: bvh/*.bvh)")
+    parser.add_argument('--rate', type=float, default=1.0, help="재생 속도 배율 (기본 1.0)")
+    parser.add_argument('--no-interp', action='store_true', help="프레임 사이 pose 보간을 끔")
+    parser.add_argument('--paused', action='store_true', help="일시정지 상태로 시작")
+    parser.add_argument('--no-cache', action='store_true', help="디스크 motion 캐시를 사용하지 않음")
+    parser.add_argument('--cache-dir', default=None, help="디스크 motion 캐시 경로")
+    parser.add_argument('--workers', type=int, default=None, help="로딩 worker 수 (기본: CPU 수)")
+    parser.add_argument('--threads', action='store_true', help="process 대신 thread pool로 로딩")
+    parser.add_argument('--crowd', action='store_true', help="crowd mode로 시작 (culling + LOD)")
+    parser.add_argument('--profile', action='store_true', help="profiler HUD를 연 상태로 시작 (F3으로 토글)")
+    parser.add_argument('--profile-trace', default=None, metavar='PATH',
+                        help="실행 내내 trace를 기록하고 종료할 때 Chrome trace JSON으로 저장")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    start_time = time.perf_counter()
+    args = parse_args(argv)
+    state['playback_rate'] = args.rate
+    state['stop'] = args.paused
+    state['crowd_mode'] = args.crowd
+    state['interpolate'] = not args.no_interp
+    state['show_profiler'] = args.profile
+    profiler = state['profiler'] = FrameProfiler()
+    if args.profile_trace:
+        profiler.start_trace()
+
+    tk.Tk().withdraw()
+    state['loader'] = MotionLoader(max_workers=args.workers, use_processes=not args.threads,
+                                   use_cache=not args.no_cache, cache_dir=args.cache_dir)
+    # 첫 프레임을 기다리게 하지 않도록 명령줄 파일은 바로 백그라운드 로딩을 시작합니다.
+    startup_files = expand_bvh_paths(args.paths)
+    state['loader'].submit_many(startup_files)
+    startup_pending = bool(startup_files)
+    first_frame = True
+
     pygame.init()
     size = (800, 600)
     screen = pygame.display.set_mode(size, pygame.DOUBLEBUF | pygame.OPENGL | pygame.RESIZABLE)
     pygame.display.set_caption("BVH Viewer")
     glEnable(GL_DEPTH_TEST)
     set_lights()
+    renderer = state['renderer'] = SkeletonRenderer()
+    crowd_drawer = CrowdDrawer(renderer)
     resize(*size)
 
     imgui.create_context()
     impl = PygameRenderer()
 
     clock = pygame.time.Clock()
+    playback = PlaybackClock()
     running = True
+    io = imgui.get_io()
     while running:
-        for event in pygame.event.get():
+        events = wait_events()
+        profiler.begin_frame()
+        events_start = time.perf_counter_ns()
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
                 continue
             impl.process_event(event)
-            io = imgui.get_io()
+            # 카메라를 움직이지 않는 scene 위의 마우스 이동만 빼고, 모든 입력은 ImGui 갱신을 위해 다시 그립니다.
+            if event.type != pygame.MOUSEMOTION or io.want_capture_mouse:
+                Events.request_redraw(state)
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3 and not io.want_capture_keyboard:
+                state['show_profiler'] = not state['show_profiler']
             if event.type == pygame.MOUSEWHEEL and not io.want_capture_mouse:
                 Events.handle_mouse_wheel(event, state)
             if event.type == pygame.MOUSEMOTION and not io.want_capture_mouse:
@@ -72,6 +218,28 @@ def main():
             if event.type == pygame.VIDEORESIZE:
                 size = event.size
                 screen = pygame.display.set_mode(size, pygame.DOUBLEBUF | pygame.OPENGL | pygame.RESIZABLE)
+        profiler.add('events', events_start, time.perf_counter_ns())
+
+        # --- 백그라운드 로딩이 끝난 motion을 프레임 사이에 추가 ---
+        with profiler.stage('loader'):
+            for file_path, virtual_root, motion in state['loader'].poll():
+                add_motion_entry(file_path, virtual_root, motion)
+        index = state['feature_index']
+        if index is not None and index.busy:
+            with profiler.stage('index'):
+                index.update()
+            if not index.busy:
+                # 끝나기를 기다리던 matching 검색을 일시정지 중에도 실행하도록 다시 그립니다.
+                Events.request_redraw(state)
+        if startup_pending and not state['loader'].busy:
+            startup_pending = False
+            print(f"Startup: {len(state['motions'])}/{len(startup_files)} motions loaded in "
+                  f"{time.perf_counter() - start_time:.2f}s")
+
+        if not running or not needs_render():
+            # 일시정지 중이고 바뀐 것이 없으면 FK와 렌더링, ImGui를 모두 건너뜁니다.
+            profiler.cancel_frame()
+            continue
 
         # 매 프레임 사이즈 갱신
         width, height = size[0], size[1]
@@ -91,64 +259,97 @@ def main():
         gluLookAt(state['eye'].x, state['eye'].y, state['eye'].z,
                   state['center'].x, state['center'].y, state['center'].z,
                   state['upVector'].x, state['upVector'].y, state['upVector'].z)
-        draw_axes()
+        with profiler.stage('axes'):
+            draw_axes(*grid_extent(scene_bounds(state['motions'])))
 
-        if state.get('motions'):
+        # 모든 motion을 같은 경과 시간만큼 진행해 frame rate가 달라도 동기화합니다.
+        with profiler.stage('playback'):
+            elapsed = playback.tick(state['stop']) * state['playback_rate']
             for motion_entry in state['motions']:
-                if motion_entry.get('visible', True):
-                    if not state['stop']:
-                        motion_entry['frame_idx'] = (motion_entry['frame_idx'] + 1) % motion_entry['frame_len']
-                    frame_idx = motion_entry['frame_idx']
-                    motion_entry['motion'].apply_to_skeleton(frame_idx, motion_entry['root'])
-                    draw_humanoid(motion_entry['root'], motion_entry['color'])
-                    if motion_entry['root'].children:
-                        draw_virtual_root_axis(
-                            extract_xz_plane(
-                                motion_entry['root'].kinematics *
-                                motion_entry['root'].children[0].kinematics
-                            ), motion_entry['color']
-                        )
+                advance_entry(motion_entry, elapsed)
+            visible_entries = [entry for entry in state['motions'] if entry.get('visible', True)]
+
+        motion_instances = {}  # profiler용: motion key -> 이번 프레임에 추가한 instance 수
+        if state['crowd_mode']:
+            # 화면 밖은 FK 없이 건너뛰고 멀리 있는 motion은 stick figure/점으로 그림
+            with profiler.stage('crowd'):
+                state['crowd_stats'] = crowd_drawer.draw(visible_entries, state['eye'])
+        else:
+            for motion_entry in visible_entries:
+                skeleton = motion_entry['skeleton']
+                fk_start = time.perf_counter_ns() if profiler.enabled else 0
+                # 재생 위치가 그대로면 (일시정지 중 카메라 이동 등) 지난 프레임의 pose를 다시 씁니다.
+                pose_key = (motion_entry['frame_pos'], True) if state['interpolate'] \
+                    else (motion_entry['frame_idx'], False)
+                if motion_entry.get('pose_key') != pose_key:
+                    if state['interpolate']:
+                        pose = motion_entry['motion'].interpolated_pose(motion_entry['frame_pos'], skeleton)
+                    else:
+                        pose = motion_entry['motion'].get_pose(motion_entry['frame_idx'], skeleton)
+                    motion_entry['pose'], motion_entry['pose_key'] = pose, pose_key
+                pose = motion_entry['pose']
+                draw_start = time.perf_counter_ns() if profiler.enabled else 0
+                instances = renderer.add(skeleton, pose, motion_entry['color'])
+                if len(skeleton) > 1:
+                    # joint 1 = pelvis (VirtualRoot의 자식)
+                    draw_virtual_root_axis(extract_xz_plane(glm.mat4(pose[1])), motion_entry['color'])
+                if profiler.enabled:
+                    draw_stop = time.perf_counter_ns()
+                    motion_key = (id(motion_entry), motion_entry['name'])
+                    profiler.add_motion(motion_key, 'fk', fk_start, draw_start)
+                    profiler.add_motion(motion_key, 'draw', draw_start, draw_stop)
+                    motion_instances[motion_key] = instances
+        # 모든 skeleton을 instancing으로 한 번에 그림
+        flush_start = time.perf_counter_ns()
+        renderer.flush()
+        flush_stop = time.perf_counter_ns()
+        profiler.add('flush', flush_start, flush_stop)
+        # skeleton은 flush에서 함께 그려지므로 motion별 draw 비용에는 flush 시간을 instance 수 비율로 나눠 더합니다.
+        profiler.share_motions('draw', flush_start, flush_stop, motion_instances)
 
         # --- ImGui 렌더링 영역 ---
-        io.display_size = width, height
-        imgui.new_frame()
-        viewport = imgui.get_main_viewport()
+        with profiler.stage('ui'):
+            io.display_size = width, height
+            imgui.new_frame()
+            viewport = imgui.get_main_viewport()
 
-        # UI 호출 (한 번만 호출)
-        UI.draw_control_panel(state, viewport)
-        UI.draw_side_panel(state, viewport)
+            # UI 호출 (한 번만 호출)
+            UI.draw_control_panel(state, viewport)
+            UI.draw_side_panel(state, viewport)
+            if state['show_profiler']:
+                UI.draw_profiler_panel(state, viewport)
 
-        imgui.render()
-        impl.render(imgui.get_draw_data())
+            imgui.render()
+        with profiler.stage('ui_render'):
+            impl.render(imgui.get_draw_data())
 
-        pygame.display.flip()
-        clock.tick(60)
+        with profiler.stage('flip'):
+            pygame.display.flip()
+        if first_frame:
+            first_frame = False
+            print(f"Startup: first frame rendered in {time.perf_counter() - start_time:.2f}s "
+                  f"({len(startup_files)} files queued)")
+        # 60fps 상한을 맞추기 위한 대기 시간은 'idle' 단계로 따로 표시됩니다.
+        with profiler.stage('idle'):
+            clock.tick(60)
+        profiler.end_frame()
+        state['redraw_frames'] = max(state['redraw_frames'] - 1, 0)
 
         # --- 파일 다이얼로그 처리 ---
         if state.get('open_file_dialog'):
             from tkinter import filedialog
-            file_path = filedialog.askopenfilename(
-                title="Select BVH file",
+            file_paths = filedialog.askopenfilenames(
+                title="Select BVH files",
                 filetypes=[("BVH Files", "*.bvh")]
             )
-            if file_path:
-                root, motion = parse_bvh(file_path)
-                joint_order = get_preorder_joint_list(root)
-                motion.build_quaternion_frames(joint_order)
-                virtual_root = motion.apply_virtual(root)
-                new_entry = {
-                    'name': file_path.split("/")[-1],
-                    'root': virtual_root,
-                    'motion': motion,
-                    'frame_len': motion.frames,
-                    'visible': True,
-                    'frame_idx': 0,
-                    'color': random_color()
-                }
-                state['motions'].append(new_entry)
-                print("File loaded:", file_path)
+            # 여러 파일을 선택하면 worker pool에서 병렬로 로드됩니다.
+            state['loader'].submit_many(file_paths)
             state['open_file_dialog'] = False
 
+    if args.profile_trace:
+        count = profiler.export_trace(args.profile_trace)
+        print(f"Profile trace: {count} events written to {args.profile_trace}")
+    state['loader'].shutdown()
     impl.shutdown()
     pygame.quit()
 
@@ -0,0 +1,223 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+from bvh_controller import Joint, VirtualRootJoint, Motion, parse_bvh, get_preorder_joint_list
+
+"""
+파싱/전처리가 끝난 Motion을 디스크에 binary(.npz)로 저장해두고 재사용하기 위한 모듈입니다.
+두 번째 로드부터는 텍스트 파싱, quaternion 변환, virtual root 분해를 모두 건너뜁니다.
+"""
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = os.environ.get(
+    'BVH_VIEWER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'bvh_viewer'))
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def skeleton_to_arrays(root):
+    """
+    Joint 트리를 preorder 순서의 배열들로 변환합니다.
+    :param root: 원본 BVH의 root joint (VirtualRoot 제외)
+    :return: dict(names, parents, offsets, channels)
+    """
+    joints = get_preorder_joint_list(root)
+    index = {id(joint): i for i, joint in enumerate(joints)}
+    return {
+        'joint_names': np.array([joint.name for joint in joints]),
+        'joint_parents': np.array([index.get(id(joint.parent), -1) for joint in joints], dtype=np.int32),
+        'joint_offsets': np.array([joint.offset for joint in joints], dtype=np.float64).reshape(-1, 3),
+        'joint_channels': np.array([' '.join(joint.channels) for joint in joints]),
+    }
+
+
+def skeleton_from_arrays(names, parents, offsets, channels):
+    """
+    skeleton_to_arrays의 역변환입니다. Joint 트리를 다시 만들어 root를 반환합니다.
+    """
+    joints = []
+    for name, parent, offset, channel_str in zip(names, parents, offsets, channels):
+        joint = Joint(str(name), [float(v) for v in offset], str(channel_str).split())
+        if parent >= 0:
+            joints[parent].add_child(joint)
+        joints.append(joint)
+    return joints[0]
+
+
+def motion_to_arrays(motion):
+    """
+    virtual root 분해까지 끝난 motion의 배열들을 저장용 dict로 반환합니다.
+    joint 축 순서는 VirtualRoot부터 시작하는 preorder입니다.
+    """
+    return {
+        'frame_time': np.float64(motion.frame_time),
+        'rotations': motion.rotations,
+        'positions': motion.positions,
+        'has_position': motion.has_position,
+    }
+
+
+def motion_from_arrays(data):
+    names = ['VirtualRoot'] + [str(name) for name in data['joint_names']]
+    return Motion.from_arrays(names, data['rotations'], data['positions'],
+                              data['has_position'], float(data['frame_time']))
+
+
+def save_motion(path, virtual_root, motion, compress=False, **extra):
+    """
+    motion을 캐시와 같은 .npz 형식으로 path에 저장합니다. 임시 파일에 쓴 뒤 교체하므로 중간에 실패해도
+    기존 파일이 깨지지 않습니다.
+    :param compress: True면 np.savez_compressed를 사용합니다. (작지만 읽고 쓰기가 느림)
+    :param extra: 함께 저장할 추가 배열 (예: source_path, source_meta)
+    """
+    arrays = skeleton_to_arrays(virtual_root.children[0])
+    arrays.update(motion_to_arrays(motion))
+    arrays.update(extra)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            (np.savez_compressed if compress else np.savez)(f, version=CACHE_VERSION, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        MotionCache._remove(tmp_path)
+        raise
+
+
+def read_motion(data):
+    """
+    save_motion으로 저장한 .npz 데이터(np.load 결과)에서 (virtual_root, motion)을 만듭니다.
+    """
+    if int(data['version']) != CACHE_VERSION:
+        raise ValueError("unsupported motion file version")
+    root = skeleton_from_arrays(data['joint_names'], data['joint_parents'],
+                                data['joint_offsets'], data['joint_channels'])
+    return VirtualRootJoint(root), motion_from_arrays(data)
+
+
+class MotionCache:
+    """
+    source path + mtime + size로 key를 만드는 크기 제한 LRU 디스크 캐시입니다.
+    캐시 파일의 mtime을 마지막 사용 시각으로 사용하고, max_bytes를 넘으면 오래된 것부터 지웁니다.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled and not os.environ.get('BVH_VIEWER_NO_CACHE')
+
+    def _source_meta(self, file_path):
+        st = os.stat(file_path)
+        return os.path.abspath(file_path), st.st_mtime_ns, st.st_size
+
+    def cache_path(self, file_path):
+        abs_path, mtime_ns, size = self._source_meta(file_path)
+        key = hashlib.sha1(f"{CACHE_VERSION}|{abs_path}|{mtime_ns}|{size}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, file_path):
+        """
+        캐시된 (virtual_root, motion)을 반환합니다. 없거나 무효하면 None을 반환합니다.
+        """
+        if not self.enabled:
+            return None
+        path = self.cache_path(file_path)
+        if not os.path.exists(path):
+            return None
+        abs_path, mtime_ns, size = self._source_meta(file_path)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = data['source_meta']
+                if (str(data['source_path']) != abs_path or int(meta[0]) != mtime_ns or int(meta[1]) != size):
+                    raise ValueError("stale cache entry")
+                virtual_root, motion = read_motion(data)
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # 잘리거나 비어 있는 파일도 지우고 None을 반환해 BVH를 다시 파싱하게 합니다.
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # LRU: 사용 시각 갱신
+        except FileNotFoundError:
+            pass  # 다른 process가 방금 evict한 경우 (이미 읽은 결과는 그대로 사용)
+        return virtual_root, motion
+
+    def store(self, file_path, virtual_root, motion):
+        """
+        전처리가 끝난 motion을 캐시에 저장하고 용량 제한에 맞춰 오래된 항목을 정리합니다.
+        """
+        if not self.enabled:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        abs_path, mtime_ns, size = self._source_meta(file_path)
+        try:
+            save_motion(self.cache_path(file_path), virtual_root, motion, source_path=abs_path,
+                        source_meta=np.array([mtime_ns, size], dtype=np.int64))
+        except OSError:
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        캐시 디렉토리 크기가 max_bytes 이하가 될 때까지 가장 오래 사용하지 않은 항목을 지웁니다.
+        """
+        try:
+            entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith('.npz')]
+        except OSError:
+            return
+        stats = []
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue  # 다른 process가 먼저 지운 항목
+            stats.append((st.st_mtime, st.st_size, entry.path))
+        stats.sort()
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for path in os.listdir(self.cache_dir) if os.path.isdir(self.cache_dir) else []:
+            if path.endswith('.npz'):
+                self._remove(os.path.join(self.cache_dir, path))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+default_cache = MotionCache()
+
+
+def load_motion(file_path, use_cache=True, cache=None, verbose=True):
+    """
+    BVH 파일을 읽어 virtual root가 적용된 (virtual_root, motion)을 반환합니다.
+    캐시가 있으면 바로 불러오고, 없으면 전체 파이프라인을 실행한 뒤 캐시에 저장합니다.
+    :param file_path: BVH 파일 경로
+    :param use_cache: False면 캐시를 읽지도 쓰지도 않습니다.
+    :param cache: 사용할 MotionCache (기본값: default_cache)
+    """
+    cache = cache or default_cache
+    if use_cache:
+        cached = cache.load(file_path)
+        if cached is not None:
+            if verbose:
+                print(f"Loaded {file_path} from cache")
+            return cached
+
+    root, motion = parse_bvh(file_path, verbose=verbose)
+    joint_order = get_preorder_joint_list(root)
+    motion.build_quaternion_frames(joint_order)
+    virtual_root = motion.apply_virtual(root)
+
+    if use_cache:
+        cache.store(file_path, virtual_root, motion)
+    return virtual_root, motion
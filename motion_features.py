@@ -0,0 +1,99 @@
+import numpy as np
+
+from virtual_transforms import quat_conjugate, quat_rotate
+
+"""
+Motion 프레임 데이터에서 pose 비교용 feature를 뽑는 함수들입니다.
+모든 값은 VirtualRoot(column 0) 기준 좌표계로 바꾸므로 motion의 위치/방향과 관계없이 자세만 비교됩니다.
+"""
+
+VELOCITY_WEIGHT = 0.1  # 속도(cm/s)를 0.1초 동안의 이동 거리로 환산해 위치(cm)와 비슷한 크기로 맞춤
+TRAJECTORY_OFFSETS = (10, 20, 30)  # future root trajectory를 볼 프레임 (30fps 기준 1/3, 2/3, 1초 뒤)
+
+
+def root_frames(motion, start=0, stop=None):
+    """
+    [start, stop) 프레임의 VirtualRoot global 회전과 위치를 반환합니다. (VirtualRoot는 root라 local = global)
+    :return: (F, 4) quaternion, (F, 3) 위치
+    """
+    rotations, positions = motion.frame_arrays(start, stop)
+    return rotations[:, 0].astype(np.float64), positions[:, 0].astype(np.float64)
+
+
+def root_relative_positions(motion, skeleton, start=0, stop=None):
+    """
+    [start, stop) 프레임의 joint 위치를 VirtualRoot 좌표계로 반환합니다.
+    :return: (F, J, 3) float64 배열
+    """
+    positions = motion.global_positions(skeleton, start, stop).astype(np.float64)
+    root_rotation, _ = root_frames(motion, start, stop)
+    inverse = quat_conjugate(root_rotation)[:, None]
+    return quat_rotate(inverse, positions - positions[:, :1])
+
+
+def end_effectors(skeleton):
+    """
+    다른 joint의 부모가 아닌 joint(손끝, 발끝, 머리 등 End Site)의 인덱스를 반환합니다.
+    """
+    return np.setdiff1d(np.arange(len(skeleton)), skeleton.parents)
+
+
+def pose_features(motion, skeleton, start=0, stop=None, velocity_weight=VELOCITY_WEIGHT, joints=None):
+    """
+    [start, stop) 프레임마다 root 기준 joint 위치, joint 속도, root 속도를 이어붙인 feature를 만듭니다.
+    속도는 바로 앞 프레임과의 차이로 구하며, 첫 프레임은 다음 프레임과의 차이를 씁니다.
+    :param joints: feature에 넣을 joint 인덱스 (None이면 모든 joint)
+    :return: (F, 6J + 3) float32 배열
+    """
+    start, stop, _ = slice(start, stop).indices(motion.frames)
+    first = max(start - 1, 0)
+    local = root_relative_positions(motion, skeleton, first, stop)
+    if joints is not None:
+        local = local[:, joints]
+    root_rotation, root_position = root_frames(motion, first, stop)
+
+    frame_time = motion.frame_time if motion.frame_time > 0 else 1.0 / 30.0
+    joint_velocity = np.diff(local, axis=0, prepend=local[:1]) / frame_time
+    root_velocity = np.diff(root_position, axis=0, prepend=root_position[:1]) / frame_time
+    root_velocity = quat_rotate(quat_conjugate(root_rotation), root_velocity)
+    if start == first and len(local) > 1:
+        joint_velocity[0], root_velocity[0] = joint_velocity[1], root_velocity[1]
+
+    skip = start - first
+    num_frames = stop - start
+    return np.concatenate([
+        local[skip:].reshape(num_frames, -1),
+        joint_velocity[skip:].reshape(num_frames, -1) * velocity_weight,
+        root_velocity[skip:] * velocity_weight,
+    ], axis=1).astype(np.float32)
+
+
+def future_trajectory(motion, start=0, stop=None, offsets=TRAJECTORY_OFFSETS):
+    """
+    [start, stop) 프레임마다 offsets 프레임 뒤의 VirtualRoot 위치와 앞 방향을 현재 VirtualRoot 좌표계의 (x, z)로 구합니다.
+    clip 끝을 넘어가는 offset은 마지막 프레임 값을 씁니다.
+    :return: (F, 2K) 위치, (F, 2K) 방향 (K = len(offsets))
+    """
+    start, stop, _ = slice(start, stop).indices(motion.frames)
+    num_frames = stop - start
+    last = min(stop + max(offsets), motion.frames)
+    rotation, position = root_frames(motion, start, last)
+    index = np.minimum(np.arange(num_frames)[:, None] + np.asarray(offsets), last - start - 1)
+    inverse = quat_conjugate(rotation[:num_frames])[:, None]
+    future_position = quat_rotate(inverse, position[index] - position[:num_frames, None])
+    future_direction = quat_rotate(inverse, quat_rotate(rotation[index], np.array([0.0, 0.0, 1.0])))
+    return (future_position[..., [0, 2]].reshape(num_frames, -1),
+            future_direction[..., [0, 2]].reshape(num_frames, -1))
+
+
+def matching_features(motion, skeleton, start=0, stop=None, offsets=TRAJECTORY_OFFSETS):
+    """
+    motion matching용 feature를 만듭니다.
+    end effector의 root 기준 위치/속도, root 속도, future root 위치/방향을 이어붙입니다.
+    :return: (F, D) float32 배열, 각 feature 그룹의 차원 수 리스트
+    """
+    joints = end_effectors(skeleton)
+    pose = pose_features(motion, skeleton, start, stop, joints=joints)
+    future_position, future_direction = future_trajectory(motion, start, stop, offsets)
+    groups = [3 * len(joints), 3 * len(joints), 3, 2 * len(offsets), 2 * len(offsets)]
+    return np.concatenate([pose, future_position, future_direction], axis=1).astype(np.float32), groups
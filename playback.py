@@ -0,0 +1,55 @@
+import time
+
+"""
+wall time과 각 motion의 frame_time으로 재생 위치를 정하는 playback clock입니다.
+모든 motion 항목이 같은 경과 시간만큼 진행하므로 frame rate가 다른 clip끼리도 동기화되고,
+렌더링이 느려지면 그만큼 motion 프레임을 건너뜁니다.
+"""
+
+DEFAULT_FRAME_TIME = 1.0 / 30.0
+MAX_STEP = 0.25  # 창 이동 등으로 루프가 멈췄을 때 한 번에 진행할 최대 시간(초)
+
+
+class PlaybackClock:
+    def __init__(self, max_step=MAX_STEP):
+        self.max_step = max_step
+        self.last = None
+
+    def tick(self, paused=False):
+        """
+        이전 tick 이후 흐른 wall time(초)을 반환합니다. 일시정지 중에는 0을 반환합니다.
+        일시정지 중에는 clock을 초기화하므로, 그리지 않고 건너뛴 프레임이 있어도 재생을 다시 시작할 때 motion이 튀지 않습니다.
+        """
+        if paused:
+            self.last = None
+            return 0.0
+        now = time.perf_counter()
+        elapsed = 0.0 if self.last is None else min(now - self.last, self.max_step)
+        self.last = now
+        return elapsed
+
+
+def frame_time_of(motion):
+    # Frame Time이 0인 BVH도 재생되도록 기본값을 사용합니다.
+    return motion.frame_time if motion.frame_time > 0 else DEFAULT_FRAME_TIME
+
+
+def advance_entry(entry, seconds):
+    """
+    motion 항목의 재생 시각을 seconds만큼 진행하고 'frame_pos'(실수 프레임 위치)와 'frame_idx'를 갱신합니다.
+    :param entry: state['motions']의 항목
+    :param seconds: 진행할 재생 시간(초), 재생 속도 배율이 이미 곱해진 값
+    """
+    frame_time = frame_time_of(entry['motion'])
+    entry['time'] = (entry.get('time', 0.0) + seconds) % (entry['frame_len'] * frame_time)
+    entry['frame_pos'] = entry['time'] / frame_time
+    # 누적 오차로 정수 프레임이 199.999...처럼 되는 것을 막습니다.
+    entry['frame_idx'] = min(int(entry['frame_pos'] + 1e-6), entry['frame_len'] - 1)
+
+
+def seek_entry(entry, frame_idx):
+    """
+    motion 항목을 frame_idx 프레임으로 이동합니다. (UI slider 등)
+    """
+    entry['time'] = (frame_idx % entry['frame_len']) * frame_time_of(entry['motion'])
+    advance_entry(entry, 0.0)
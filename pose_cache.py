@@ -0,0 +1,99 @@
+import weakref
+from collections import OrderedDict
+
+"""
+재생/스크러빙 중 같은 프레임의 FK를 반복 계산하지 않도록 global joint transform을 저장하는 LRU 캐시입니다.
+"""
+
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+DEFAULT_BLOCK_SIZE = 32
+
+
+class PoseCache:
+    """
+    (motion, frame index) -> (J, 4, 4) global transform 캐시입니다.
+    miss가 나면 해당 프레임이 속한 block_size 프레임 구간을 batched FK로 한 번에 계산해 저장하므로
+    순차 재생에서는 block마다 한 번만 FK가 실행됩니다. 메모리 사용량이 max_bytes를 넘으면
+    가장 오래 사용하지 않은 block부터 지웁니다.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, block_size=DEFAULT_BLOCK_SIZE):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.blocks = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tracked = set()
+
+    def get(self, motion, frame_index, skeleton):
+        """
+        frame_index 프레임의 global transform을 반환합니다.
+        :param motion: Motion (global_transforms(skeleton, start, stop)을 제공해야 함)
+        :param frame_index: 프레임 인덱스
+        :param skeleton: motion과 같은 joint 순서의 Skeleton
+        :return: (J, 4, 4) float32 배열 (캐시 내부 버퍼의 view이므로 수정하면 안 됩니다)
+        """
+        block_index, offset = divmod(frame_index, self.block_size)
+        key = (id(motion), id(skeleton), block_index)
+        block = self.blocks.get(key)
+        if block is not None:
+            self.hits += 1
+            self.blocks.move_to_end(key)
+            return block[offset]
+
+        self.misses += 1
+        start = block_index * self.block_size
+        block = motion.global_transforms(skeleton, start, min(start + self.block_size, motion.frames))
+        block.flags.writeable = False
+        self._track(motion)
+        self.blocks[key] = block
+        self.nbytes += block.nbytes
+        self._evict()
+        return block[offset]
+
+    def invalidate(self, motion):
+        """
+        motion에 대한 모든 항목을 지웁니다.
+        """
+        self._drop(id(motion))
+
+    def clear(self):
+        self.blocks.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+            'blocks': len(self.blocks),
+            'bytes': self.nbytes,
+        }
+
+    def _track(self, motion):
+        # motion이 GC되면 같은 id가 재사용되기 전에 항목을 지웁니다.
+        motion_id = id(motion)
+        if motion_id not in self._tracked:
+            self._tracked.add(motion_id)
+            weakref.finalize(motion, self._forget, motion_id)
+
+    def _forget(self, motion_id):
+        self._tracked.discard(motion_id)
+        self._drop(motion_id)
+
+    def _drop(self, motion_id):
+        for key in [key for key in self.blocks if key[0] == motion_id]:
+            self.nbytes -= self.blocks.pop(key).nbytes
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self.blocks) > 1:
+            _, block = self.blocks.popitem(last=False)
+            self.nbytes -= block.nbytes
+            self.evictions += 1
+
+
+default_pose_cache = PoseCache()
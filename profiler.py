@@ -0,0 +1,205 @@
+import json
+import os
+import time
+
+import numpy as np
+
+"""
+메인 루프의 단계별 시간을 재는 가벼운 frame profiler입니다.
+단계마다 최근 history 프레임의 시간을 ring buffer로 보관하고, motion별 FK/draw 비용을 평균내며,
+필요하면 Chrome trace(JSON, chrome://tracing 또는 Perfetto에서 열기)로 내보냅니다.
+"""
+
+DEFAULT_HISTORY = 240
+MAX_TRACE_EVENTS = 1000000
+MOTION_SMOOTHING = 0.1
+
+
+class _Stage:
+    # with profiler.stage(name): 로 쓰는 재사용 context manager입니다.
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class FrameProfiler:
+    """
+    사용법:
+        profiler.begin_frame()
+        with profiler.stage('events'):
+            ...
+        profiler.end_frame()
+    enabled가 False면 stage()가 아무것도 하지 않는 객체를 반환하므로 비용이 거의 없습니다.
+    """
+
+    def __init__(self, history=DEFAULT_HISTORY, enabled=True):
+        self.history = history
+        self.enabled = enabled
+        self.frame_count = 0
+        self.stage_names = []
+        self.samples = {}  # stage 이름 -> (history,) float32 ms ring buffer
+        self.frame_samples = np.zeros(history, dtype=np.float32)
+        self.motion_costs = {}  # (id(entry), motion 이름) -> {'fk': ms, 'draw': ms} (지수 이동 평균)
+        self.tracing = False
+        self.trace_events = []
+        self._stages = {}
+        self._current = {}
+        self._motion_current = {}
+        self._frame_start = None
+        self._origin = time.perf_counter_ns()
+
+    # --- 측정 ---
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self._frame_start = time.perf_counter_ns()
+        self._current.clear()
+        self._motion_current.clear()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = _Stage(self, name)
+        return stage
+
+    def add(self, name, start_ns, stop_ns, args=None):
+        """
+        [start_ns, stop_ns) 구간을 name 단계에 더합니다. (한 프레임에 여러 번 호출되면 합산)
+        """
+        if not self.enabled:
+            return
+        if name not in self.samples:
+            self.stage_names.append(name)
+            self.samples[name] = np.zeros(self.history, dtype=np.float32)
+        self._current[name] = self._current.get(name, 0) + (stop_ns - start_ns)
+        self._trace(name, start_ns, stop_ns, args)
+
+    def add_motion(self, motion_key, kind, start_ns, stop_ns):
+        """
+        motion 하나의 비용(kind: 'fk' 또는 'draw')을 kind 단계와 motion별 평균에 함께 더합니다.
+        :param motion_key: (id(entry), 이름). 이름이 같은 clip도 따로 집계되도록 entry마다 다른 key를 씁니다.
+        """
+        if not self.enabled:
+            return
+        self.add(kind, start_ns, stop_ns, {'motion': motion_key[1]})
+        costs = self._motion_current.setdefault(motion_key, {'fk': 0, 'draw': 0})
+        costs[kind] += stop_ns - start_ns
+
+    def share_motions(self, kind, start_ns, stop_ns, weights):
+        """
+        여러 motion이 함께 쓴 [start_ns, stop_ns) 구간(예: 모든 skeleton을 한 번에 그리는 flush)을
+        weights 비율로 나눠 motion별 kind 비용에 더합니다. 단계 시간은 따로 기록되므로 kind 단계에는 더하지 않습니다.
+        :param weights: motion_key -> 가중치 (예: instance 수)
+        """
+        total = sum(weights.values())
+        if not self.enabled or not total:
+            return
+        for motion_key, weight in weights.items():
+            costs = self._motion_current.setdefault(motion_key, {'fk': 0, 'draw': 0})
+            costs[kind] += (stop_ns - start_ns) * weight // total
+
+    def cancel_frame(self):
+        """
+        그리지 않고 건너뛴 프레임은 기록하지 않습니다.
+        """
+        self._frame_start = None
+
+    def end_frame(self):
+        if not self.enabled or self._frame_start is None:
+            return
+        stop = time.perf_counter_ns()
+        slot = self.frame_count % self.history
+        self.frame_samples[slot] = (stop - self._frame_start) / 1e6
+        for name, samples in self.samples.items():
+            samples[slot] = self._current.get(name, 0) / 1e6
+        self._trace('frame', self._frame_start, stop, None)
+
+        # motion별 비용은 지수 이동 평균으로 보관하고, 이번 프레임에 없는 motion은 지웁니다.
+        motion_costs = {}
+        for motion_key, costs in self._motion_current.items():
+            previous = self.motion_costs.get(motion_key)
+            current = {kind: ns / 1e6 for kind, ns in costs.items()}
+            if previous is not None:
+                current = {kind: previous[kind] + (ms - previous[kind]) * MOTION_SMOOTHING
+                           for kind, ms in current.items()}
+            motion_costs[motion_key] = current
+        self.motion_costs = motion_costs
+        self.frame_count += 1
+        self._frame_start = None
+
+    # --- 조회 ---
+
+    def ordered_samples(self, samples):
+        """
+        ring buffer를 오래된 것부터 순서대로 반환합니다. (아직 채워지지 않은 부분 제외)
+        """
+        count = min(self.frame_count, self.history)
+        start = self.frame_count % self.history if self.frame_count >= self.history else 0
+        return np.roll(samples, -start)[:count]
+
+    def stats(self):
+        """
+        :return: {'frame': (평균 ms, 최대 ms), stage 이름: (평균 ms, 최대 ms), ...}
+        """
+        result = {}
+        for name, samples in [('frame', self.frame_samples)] + [(n, self.samples[n]) for n in self.stage_names]:
+            recent = self.ordered_samples(samples)
+            result[name] = (float(recent.mean()), float(recent.max())) if len(recent) else (0.0, 0.0)
+        return result
+
+    # --- trace ---
+
+    def _trace(self, name, start_ns, stop_ns, args):
+        if self.tracing and len(self.trace_events) < MAX_TRACE_EVENTS:
+            self.trace_events.append((name, start_ns, stop_ns, args))
+
+    def start_trace(self):
+        self.trace_events = []
+        self.tracing = True
+
+    def stop_trace(self):
+        self.tracing = False
+
+    def export_trace(self, path):
+        """
+        기록된 구간들을 Chrome trace event 형식(JSON)으로 저장합니다.
+        :return: 저장한 event 수
+        """
+        events = []
+        for name, start_ns, stop_ns, args in self.trace_events:
+            event = {'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                     'ts': (start_ns - self._origin) / 1e3, 'dur': (stop_ns - start_ns) / 1e3}
+            if args:
+                event['args'] = args
+            events.append(event)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
@@ -0,0 +1,139 @@
+import time
+
+import numpy as np
+
+from bvh_controller import connect, MotionSequence
+from motion_features import pose_features
+
+"""
+두 motion을 이어붙일 때 가장 자연스러운 전환 구간을 찾는 모듈입니다.
+A의 끝부분과 B의 앞부분 프레임들 사이의 pose 거리 행렬을 한 번의 행렬 곱으로 만들고,
+대각선 누적합으로 모든 (A 시작, B 시작, 구간 길이) 조합의 평균 거리를 Python 이중 루프 없이 계산합니다.
+평균 거리만 비교하면 짧은 구간이 거의 항상 이기므로, 거리 차이를 짧은 구간에 몰아서 blending하는 만큼 비용을 더합니다.
+"""
+
+DEFAULT_SEARCH_FRAMES = 600
+DEFAULT_WINDOWS = (20, 30, 45, 60, 100)  # 너무 짧으면 blending이 급해지므로 20프레임부터
+MAX_CANDIDATES = 200  # 한 축의 후보 프레임이 이보다 많으면 stride를 두고 찾은 뒤 주변만 다시 찾음
+REFINE_COUNT = 8  # stride로 찾은 결과 중 주변을 다시 찾을 상위 후보 수
+SHORT_BLEND_FRAMES = 30  # 비용 = 평균 거리 * (1 + SHORT_BLEND_FRAMES / 구간 길이)
+
+
+def pairwise_distances(a, b):
+    """
+    :param a: (N, D) feature
+    :param b: (M, D) feature
+    :return: (N, M) 유클리드 거리 행렬
+    """
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    squared = np.einsum('ij,ij->i', a, a)[:, None] + np.einsum('ij,ij->i', b, b)[None] - 2.0 * (a @ b.T)
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def diagonal_cumsum(distances):
+    """
+    C[i, j] = distances[i-1, j-1] + distances[i-2, j-2] + ... 인 (N+1, M+1) 대각선 누적합을 만듭니다.
+    길이 n 구간의 합은 C[i+n, j+n] - C[i, j]로 바로 구할 수 있습니다. (행 수만큼만 반복)
+    """
+    cumulative = np.zeros((distances.shape[0] + 1, distances.shape[1] + 1))
+    for i in range(1, cumulative.shape[0]):
+        np.add(distances[i - 1], cumulative[i - 1, :-1], out=cumulative[i, 1:])
+    return cumulative
+
+
+def transition_cost(mean_distance, length):
+    """
+    길이 length인 blending 구간의 비용입니다.
+    평균 거리 d를 n프레임에 걸쳐 blending하면 프레임마다 pose가 d / n씩 더 바뀌므로, 그 속도를
+    SHORT_BLEND_FRAMES 기준으로 평균 거리에 더해 길이가 다른 구간끼리 공정하게 비교합니다.
+    """
+    return mean_distance * (1.0 + SHORT_BLEND_FRAMES / length)
+
+
+def _search(features_a, features_b, windows, stride, count=1):
+    # 비용이 가장 작은 count개의 (비용, A 시작, B 시작, 구간 길이)를 반환합니다. (시작 인덱스는 features 기준)
+    cumulative = diagonal_cumsum(pairwise_distances(features_a[::stride], features_b[::stride]))
+    candidates = []
+    for length in windows:
+        steps = max(length // stride, 1)
+        valid_a = (len(features_a) - length) // stride + 1
+        valid_b = (len(features_b) - length) // stride + 1
+        if valid_a <= 0 or valid_b <= 0 or steps >= cumulative.shape[0] or steps >= cumulative.shape[1]:
+            continue
+        means = (cumulative[steps:, steps:] - cumulative[:-steps, :-steps])[:valid_a, :valid_b] / steps
+        costs = transition_cost(means, length)
+        flat = costs.ravel()
+        best = np.argpartition(flat, min(count, flat.size) - 1)[:count]
+        for i, j in zip(*np.unravel_index(best, costs.shape)):
+            candidates.append((float(costs[i, j]), int(i) * stride, int(j) * stride, length))
+    return sorted(candidates)[:count]
+
+
+def find_transition(motion_a, skeleton_a, motion_b, skeleton_b, windows=DEFAULT_WINDOWS,
+                    search_frames=DEFAULT_SEARCH_FRAMES, stride=None, verbose=True):
+    """
+    motion_a의 마지막 search_frames 프레임과 motion_b의 처음 search_frames 프레임 중에서
+    blending 구간의 비용(transition_cost)이 가장 작은 (A 구간, B 구간, 길이)를 찾습니다.
+    :param windows: 시도할 transition 길이(프레임) 목록
+    :param stride: 후보 프레임 간격 (None이면 후보가 MAX_CANDIDATES개 이하가 되도록 자동 설정)
+    :return: dict(a_end, b_start, transition_frames, cost, distance (구간의 평균 pose 거리))
+             connect(motion_a[:a_end], motion_b, transition_frames, b_start)로 이어붙이면 됩니다.
+    """
+    start_time = time.perf_counter()
+    if motion_a.joint_names != motion_b.joint_names:
+        raise ValueError("Motions have different joints.")
+    # 짧은 clip이라도 A의 앞 절반과 B의 뒤 절반은 항상 남도록 탐색 범위를 제한합니다.
+    a_start = max(motion_a.frames - search_frames, motion_a.frames // 2)
+    features_a = pose_features(motion_a, skeleton_a, a_start)
+    features_b = pose_features(motion_b, skeleton_b, 0, min(search_frames, (motion_b.frames + 1) // 2))
+    windows = sorted(length for length in windows if length <= min(len(features_a), len(features_b)))
+    if not windows:
+        raise ValueError("Not enough frames to search for a transition.")
+
+    if stride is None:
+        stride = max(1, max(len(features_a), len(features_b)) // MAX_CANDIDATES)
+    if stride == 1:
+        cost, i, j, length = _search(features_a, features_b, windows, 1)[0]
+    else:
+        # stride로 찾은 상위 후보들의 주변 ±stride 프레임만 stride 1로 다시 찾습니다.
+        best = None
+        for _, i, j, length in _search(features_a, features_b, windows, stride, REFINE_COUNT):
+            a0, b0 = max(i - stride, 0), max(j - stride, 0)
+            local = _search(features_a[a0:i + stride + length], features_b[b0:j + stride + length], windows, 1)
+            if local and (best is None or local[0][0] < best[0]):
+                best = (local[0][0], a0 + local[0][1], b0 + local[0][2], local[0][3])
+        cost, i, j, length = best
+
+    transition = {'a_end': a_start + i + length, 'b_start': j, 'transition_frames': length, 'cost': cost,
+                  'distance': cost / transition_cost(1.0, length)}
+    if verbose:
+        print(f"Transition: A[{a_start + i}:{transition['a_end']}] -> B[{j}:{j + length}], "
+              f"cost {cost:.2f} (distance {transition['distance']:.2f}) "
+              f"in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+    return transition
+
+
+def connect_best(motion_a, skeleton_a, motion_b, skeleton_b, **kwargs):
+    """
+    find_transition으로 찾은 구간에서 motion_a와 motion_b를 이어붙입니다.
+    :return: (CompositeMotion, transition dict)
+    """
+    transition = find_transition(motion_a, skeleton_a, motion_b, skeleton_b, **kwargs)
+    connected = connect(motion_a[:transition['a_end']], motion_b,
+                        transition_frames=transition['transition_frames'], start_index_m2=transition['b_start'])
+    return connected, transition
+
+
+def sequence_best(motions, skeletons, **kwargs):
+    """
+    motions를 순서대로 이어붙인 MotionSequence를 만듭니다. 이웃한 두 motion마다 find_transition으로 구간을 찾습니다.
+    :param skeletons: motions와 같은 순서의 Skeleton 리스트
+    :return: MotionSequence
+    """
+    segments = [[motions[0], 0, None, 0]]
+    for i in range(1, len(motions)):
+        transition = find_transition(motions[i - 1], skeletons[i - 1], motions[i], skeletons[i], **kwargs)
+        segments[-1][2] = transition['a_end']
+        segments.append([motions[i], transition['b_start'], None, transition['transition_frames']])
+    return MotionSequence([tuple(segment) for segment in segments])
@@ -2,18 +2,12 @@ from OpenGL.GL import *
 from OpenGL.GLUT import *
 from OpenGL.GLU import *
 
+import math
+
 import numpy as np
 from pyglm import glm
 import random
 
-colors = [
-    [1.0, 0.0, 0.0],
-    [0.0, 1.0, 0.0],
-    [0.0, 0.0, 1.0],
-    [1.0, 1.0, 0.0],
-    [1.0, 0.0, 1.0],
-    [0.0, 1.0, 1.0]
-]
 vertices = [
     [-1.0, -1.0, 1.0], [1.0, -1.0, 1.0], [1.0, 1.0, 1.0], [-1.0, 1.0, 1.0],
     [-1.0, -1.0, -1.0], [1.0, -1.0, -1.0], [1.0, 1.0, -1.0], [-1.0, 1.0, -1.0],
@@ -48,52 +42,137 @@ def blend_color(colora, colorb):
 
 
 
-def draw_colored_cube(size_x, size_y=-1, size_z=-1, color=None):
+# 관절 sphere mesh의 (slices, stacks). SkeletonRenderer가 instancing하는 mesh에 사용됩니다.
+SPHERE_DETAIL = (16, 12)
+
+
+def cube_mesh():
     """
-    면을 구분하거나 지정된 색상으로 칠한 cube를 생성하는 함수입니다.
-    :param size_x: cube의 x길이
-    :param size_y: cube의 y길이
-    :param size_z: cube의 z길이
-    :param color: (R, G, B) float 튜플, 지정된 색상으로 전체 면을 칠함
+    [-1, 1] 단위 cube를 VBO용 삼각형 배열로 만듭니다.
+    :return: (36, 6) float32 배열 (position xyz, normal xyz)
     """
-    if (size_y < 0): size_y = size_x
-    if (size_z < 0): size_z = size_x
-    glPushMatrix()
-    glScaled(size_x, size_y, size_z)
-    glBegin(GL_QUADS)
+    mesh = []
     for i in range(6):
-        if color:
-            glColor3fv(color)
-        else:
-            glColor3fv(colors[i])
-        glNormal3fv(normals[i])
-        for j in range(4):
-            glVertex3fv(vertices[i * 4 + j])
-    glEnd()
-    glPopMatrix()
+        quad = [vertices[i * 4 + j] + normals[i] for j in range(4)]
+        mesh.extend([quad[0], quad[1], quad[2], quad[0], quad[2], quad[3]])
+    return np.array(mesh, dtype=np.float32)
+
+
+def sphere_mesh(slices=None, stacks=None):
+    """
+    반지름 1인 UV sphere를 VBO용 삼각형 배열로 만듭니다.
+    :param slices: 경도 방향 분할 수 (기본값: SPHERE_DETAIL)
+    :param stacks: 위도 방향 분할 수 (기본값: SPHERE_DETAIL)
+    :return: (N, 6) float32 배열 (position xyz, normal xyz; 단위 구이므로 둘이 같음)
+    """
+    slices = slices or SPHERE_DETAIL[0]
+    stacks = stacks or SPHERE_DETAIL[1]
+    theta = np.linspace(0, np.pi, stacks + 1)
+    phi = np.linspace(0, 2 * np.pi, slices + 1)
+    grid = np.stack([
+        np.sin(theta)[:, None] * np.cos(phi)[None, :],
+        np.cos(theta)[:, None] * np.ones_like(phi)[None, :],
+        np.sin(theta)[:, None] * np.sin(phi)[None, :],
+    ], axis=-1)
+    a, b = grid[:-1, :-1], grid[1:, :-1]
+    c, d = grid[1:, 1:], grid[:-1, 1:]
+    triangles = np.stack([a, c, b, a, d, c], axis=2).reshape(-1, 3)
+    return np.concatenate([triangles, triangles], axis=1).astype(np.float32)
+
+
+# (종류, 분할 수...) -> display list id. 프리미티브를 한 번만 tessellate하고 재사용합니다.
+_display_lists = {}
+
+DISK_SLICES = 32
 
 
-def draw_colored_sphere(radius):
+def _cached_list(key, build):
     """
-    Quadric object인 sphere을 생성하기 위한 함수입니다.
-    :param radius: sphere의 크기
+    key에 해당하는 display list를 반환합니다.
+    없거나 (context가 다시 만들어져) 무효하면 build()로 새로 컴파일합니다.
     """
-    quadric = gluNewQuadric()  # Quadric object 생성 (http://www.gisdeveloper.co.kr/?p=35)
+    list_id = _display_lists.get(key)
+    if list_id is None or not glIsList(list_id):
+        list_id = glGenLists(1)
+        glNewList(list_id, GL_COMPILE)
+        build()
+        glEndList()
+        _display_lists[key] = list_id
+    return list_id
+
+
+def _unit_primitive_list(key, build):
+    """
+    반지름 1짜리 quadric 프리미티브를 display list로 만들어 반환합니다.
+    :param build: quadric을 받아 프리미티브를 그리는 함수
+    """
+    def compile_quadric():
+        quadric = gluNewQuadric()
+        build(quadric)
+        gluDeleteQuadric(quadric)
+    return _cached_list(key, compile_quadric)
+
+
+def _call_scaled(list_id, scale):
+    # 단위 프리미티브를 scale해서 그리므로 조명 normal이 같이 줄어들지 않게 GL_NORMALIZE를 켭니다.
+    if scale == 1.0:
+        glCallList(list_id)
+        return
+    glPushAttrib(GL_ENABLE_BIT)
+    glEnable(GL_NORMALIZE)
     glPushMatrix()
-    glColor3fv((1.0, 0.0, 0.0))
-    gluSphere(quadric, radius, 30, 30)
+    glScalef(scale, scale, scale)
+    glCallList(list_id)
     glPopMatrix()
-    gluDeleteQuadric(quadric)  # 다 쓰고 이렇게 삭제해줘야 되더라
+    glPopAttrib()
 
 
-def draw_axes(grid_size = 500, step = 10):
+def release_display_lists():
+    """
+    캐시된 프리미티브 display list를 모두 삭제합니다. GL context가 살아 있을 때 호출해야 합니다.
+    """
+    for list_id in _display_lists.values():
+        if glIsList(list_id):
+            glDeleteLists(list_id, 1)
+    _display_lists.clear()
+
+
+def draw_axes(grid_size=500, step=10):
     """
     축과 격자를 그리기 위한 함수입니다.
-    grid_size를 미리 정의해서 그 길이만큼 격자랑 XYZ axis 그리게 해두었습니다.
-    축의 길이가 너무 짧아 길게 설정하였는데 그만큼 Clipping distance도 늘렸습니다
-    TODO: CLippind distance랑 연계하기.
+    grid_size 길이만큼 격자랑 XYZ axis를 그립니다. 격자는 바뀌지 않으므로 display list로 한 번만 만들고,
+    grid_size나 step이 바뀔 때만 다시 만듭니다.
+    :param grid_size: 원점에서 격자 끝까지의 거리
+    :param step: 격자 간격
     """
+    key = ('axes', grid_size, step)
+    if key not in _display_lists:
+        for old_key in [k for k in _display_lists if k[0] == 'axes']:
+            list_id = _display_lists.pop(old_key)
+            if glIsList(list_id):
+                glDeleteLists(list_id, 1)
+    glCallList(_cached_list(key, lambda: _emit_axes(grid_size, step)))
+
 
+def grid_extent(bounds, step=10, margin=100, max_lines=200):
+    """
+    motion들이 움직이는 영역을 덮는 격자 크기와 간격을 구합니다.
+    영역이 커지면 한 방향의 격자 선이 max_lines개를 넘지 않도록 간격을 두 배씩 늘립니다.
+    :param bounds: (min xyz, max xyz) 또는 None (None이면 기본 크기 500)
+    :param margin: 영역 바깥으로 더 그릴 여유 거리
+    :return: (grid_size, step)
+    """
+    if bounds is None:
+        return 500, step
+    lo, hi = bounds
+    half = max(abs(lo[0]), abs(lo[2]), abs(hi[0]), abs(hi[2])) + margin
+    while 2 * half / step > max_lines:
+        step *= 2
+    return int(math.ceil(half / step)) * step, step
+
+
+def _emit_axes(grid_size, step):
+    # draw_axes의 display list에 기록되는 실제 그리기 명령입니다.
     glLineWidth(2.0)
 
     # Draw XYZ axes
@@ -201,11 +280,19 @@ def bone_rotation(forward):
         rot = rotation_between_vectors(forward, originalDir)
     return rot
 
-def draw_undercircle(radius=1.0):
-    quadric = gluNewQuadric()
-    gluQuadricDrawStyle(quadric, GLU_FILL)  # 채워진 스타일로 설정
-    gluDisk(quadric, 0.0, radius, 32, 1)
-    gluDeleteQuadric(quadric)
+def draw_undercircle(radius=1.0, slices=None):
+    """
+    미리 tessellate해 둔 단위 disk display list로 채워진 원을 그립니다.
+    :param radius: 원의 반지름
+    :param slices: 원주 분할 수 (기본값: DISK_SLICES)
+    """
+    slices = slices or DISK_SLICES
+
+    def build(quadric):
+        gluQuadricDrawStyle(quadric, GLU_FILL)  # 채워진 스타일로 설정
+        gluDisk(quadric, 0.0, 1.0, slices, 1)
+
+    _call_scaled(_unit_primitive_list(('disk', slices), build), radius)
 
 def draw_arrow(circle_radius, arrow_length, color):
 
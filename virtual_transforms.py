@@ -1,5 +1,6 @@
 from pyglm import glm
 import math
+import numpy as np
 
 
 def quaternion_to_euler(w, x, y, z, degrees=True):
@@ -29,6 +30,157 @@ def quaternion_to_euler(w, x, y, z, degrees=True):
     return yaw, pitch, roll
 
 
+
+AXIS_INDEX = {'X': 0, 'Y': 1, 'Z': 2}
+
+
+def quat_mul(a, b):
+    """
+    (..., 4) quaternion 배열(w, x, y, z)끼리의 곱 a * b를 한 번에 계산합니다.
+    """
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack([
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ], axis=-1)
+
+
+def euler_to_quat(angles, order):
+    """
+    BVH 채널 순서(order)대로 Euler 각을 quaternion으로 변환합니다.
+    q = R(order[0]) * R(order[1]) * ... 로, build_quaternion_frames의 per-frame 계산과 같습니다.
+    매 단계 곱하는 쪽이 축 회전(성분 2개)이므로 일반 quat_mul 대신 성분별로 직접 전개합니다.
+    :param angles: (..., len(order)) 라디안 각도 배열
+    :param order: 'ZYX', 'ZXY' 처럼 축 이름 문자열
+    :return: (..., 4) quaternion 배열
+    """
+    half = np.asarray(angles) * 0.5
+    cos, sin = np.cos(half), np.sin(half)
+    w = cos[..., 0]
+    xyz = [np.zeros_like(w), np.zeros_like(w), np.zeros_like(w)]
+    xyz[AXIS_INDEX[order[0]]] = sin[..., 0]
+    x, y, z = xyz
+    for k in range(1, len(order)):
+        c, s = cos[..., k], sin[..., k]
+        if order[k] == 'X':
+            w, x, y, z = w * c - x * s, x * c + w * s, y * c + z * s, z * c - y * s
+        elif order[k] == 'Y':
+            w, x, y, z = w * c - y * s, x * c - z * s, y * c + w * s, z * c + x * s
+        else:
+            w, x, y, z = w * c - z * s, x * c + y * s, y * c - x * s, z * c + w * s
+    return np.stack([w, x, y, z], axis=-1)
+
+
+def quat_conjugate(q):
+    """
+    (..., 4) quaternion 배열의 켤레를 반환합니다. (단위 quaternion이면 역원)
+    """
+    return q * np.array([1.0, -1.0, -1.0, -1.0], dtype=q.dtype)
+
+
+def quat_slerp(q1, q2, t):
+    """
+    (..., 4) quaternion 배열끼리 glm.slerp과 같은 방식(최단 경로, 거의 같으면 선형 보간)으로 보간합니다.
+    :param t: q1, q2의 앞쪽 축에 broadcast 가능한 보간 비율 배열
+    """
+    t = np.asarray(t, dtype=q1.dtype)[..., None]
+    cos_theta = np.sum(q1 * q2, axis=-1, keepdims=True)
+    q2 = np.where(cos_theta < 0, -q2, q2)
+    cos_theta = np.abs(cos_theta)
+    theta = np.arccos(np.clip(cos_theta, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    linear = cos_theta > 1.0 - 1e-6
+    safe_sin = np.where(linear, 1.0, sin_theta)
+    w1 = np.where(linear, 1.0 - t, np.sin((1.0 - t) * theta) / safe_sin)
+    w2 = np.where(linear, t, np.sin(t * theta) / safe_sin)
+    return w1 * q1 + w2 * q2
+
+
+def quat_to_mat3(q):
+    """
+    (..., 4) quaternion(w, x, y, z) 배열을 (..., 3, 3) 회전 행렬 배열로 변환합니다.
+    """
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    m = np.empty(q.shape[:-1] + (3, 3), dtype=q.dtype)
+    m[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    m[..., 0, 1] = 2 * (x * y - w * z)
+    m[..., 0, 2] = 2 * (x * z + w * y)
+    m[..., 1, 0] = 2 * (x * y + w * z)
+    m[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    m[..., 1, 2] = 2 * (y * z - w * x)
+    m[..., 2, 0] = 2 * (x * z - w * y)
+    m[..., 2, 1] = 2 * (y * z + w * x)
+    m[..., 2, 2] = 1 - 2 * (x * x + y * y)
+    return m
+
+
+def quat_rotate(q, v):
+    """
+    (..., 4) quaternion으로 (..., 3) 벡터를 회전합니다. (glm의 quat * vec3와 같음)
+    """
+    u = q[..., 1:]
+    t = 2.0 * np.cross(u, v)
+    return v + q[..., :1] * t + np.cross(u, t)
+
+
+def bone_rotation_batch(forward):
+    """
+    utils.bone_rotation의 배열 버전입니다. (B, 3) 뼈 방향 벡터들에 대한 quaternion을 한 번에 계산합니다.
+    :param forward: (B, 3) 뼈 방향 (자식 joint의 offset)
+    :return: (B, 4) quaternion (w, x, y, z)
+    """
+    forward = np.asarray(forward, dtype=np.float64).reshape(-1, 3)
+    up = np.array([0.0, 1.0, 0.0])
+    q = np.zeros((len(forward), 4))
+    q[:, 0] = 1.0
+
+    parallel = np.einsum('ij,ij->i', np.cross(up, forward), np.cross(up, forward)) < 1e-6
+    q[parallel & (forward[:, 1] < 0)] = (0.0, 0.0, 1.0, 0.0)  # y축으로 180도
+
+    general = ~parallel
+    v1 = forward[general] / np.linalg.norm(forward[general], axis=1, keepdims=True)
+    s = np.sqrt((1.0 + v1[:, 1]) * 2.0)
+    q[general, 0] = s * 0.5
+    q[general, 1:] = np.cross(v1, up) / s[:, None]
+    return q
+
+
+def forward_kinematics(rotations, translations, parents, positions_only=False):
+    """
+    여러 프레임의 global joint transform을 한 번에 계산합니다.
+    joint는 topological(preorder) 순서여야 하며, joint 수만큼만 반복하고 프레임 축은 vectorize합니다.
+    내부적으로 (J, F, ...) 순서로 바꿔 joint별 연산이 연속 메모리에서 이루어지게 합니다.
+    :param rotations: (F, J, 4) local quaternion
+    :param translations: (F, J, 3) local translation (offset + position 채널)
+    :param parents: (J,) parent 인덱스 배열 (root는 -1)
+    :param positions_only: True면 (F, J, 3) global position만 반환합니다.
+    :return: (F, J, 4, 4) global transform (translation은 [..., :3, 3]) 또는 (F, J, 3)
+    """
+    local_rot = np.ascontiguousarray(np.swapaxes(rotations, 0, 1))
+    local_pos = np.ascontiguousarray(np.swapaxes(translations, 0, 1))
+    global_rot = np.empty_like(local_rot)
+    global_pos = np.empty_like(local_pos)
+    for j, p in enumerate(parents):
+        if p < 0:
+            global_rot[j] = local_rot[j]
+            global_pos[j] = local_pos[j]
+        else:
+            global_rot[j] = quat_mul(global_rot[p], local_rot[j])
+            global_pos[j] = quat_rotate(global_rot[p], local_pos[j]) + global_pos[p]
+
+    if positions_only:
+        return np.swapaxes(global_pos, 0, 1)
+
+    transforms = np.zeros((local_rot.shape[1], local_rot.shape[0], 4, 4), dtype=global_rot.dtype)
+    transforms[..., :3, :3] = quat_to_mat3(np.swapaxes(global_rot, 0, 1))
+    transforms[..., :3, 3] = np.swapaxes(global_pos, 0, 1)
+    transforms[..., 3, 3] = 1.0
+    return transforms
+
+
 def get_projection(v: glm.vec3, onto: glm.vec3):
     onto_norm = glm.normalize(onto)
     return glm.dot(v, onto_norm) * onto_norm
@@ -57,8 +209,6 @@ def get_pelvis_virtual(ap: glm.vec3, ar: glm.quat):
     new_ar = r_inv * ar
     return new_ap, new_ar
 
-prev_r_inv = glm.quat(1, 0, 0, 0)  # 전역에서 초기화해 사용 가능
-
 def get_pelvis_virtual_safe(ap: glm.vec3, ar: glm.quat, 
                             fallback_forward=glm.vec3(0, 0, 1),
                             smooth_ratio=0.2,
@@ -101,6 +251,60 @@ def get_pelvis_virtual_safe(ap: glm.vec3, ar: glm.quat,
 
 
 
+
+def smooth_yaw(yaw, smooth_ratio):
+    """
+    yaw 각 시퀀스에 get_pelvis_virtual_safe와 같은 low-pass filter(이전 값과 slerp)를 순서대로 적용합니다.
+    같은 축 회전끼리의 slerp는 최단 경로 각도 보간과 같으므로 각도 배열 위에서 스캔합니다.
+    :param yaw: (F,) 라디안 각 배열
+    :param smooth_ratio: slerp 보간 비율 (0~1, 높을수록 빠르게 변화)
+    :return: (F,) 필터링된 각 배열 (첫 프레임은 0(identity)에서 시작)
+    """
+    smoothed = np.empty(len(yaw), dtype=np.float64)
+    prev = 0.0
+    for i, angle in enumerate(yaw.tolist()):
+        delta = (angle - prev + math.pi) % (2 * math.pi) - math.pi
+        prev += smooth_ratio * delta
+        smoothed[i] = prev
+    return smoothed
+
+
+def get_pelvis_virtual_batch(ap, ar, fallback_forward=(0.0, 0.0, 1.0), smooth_ratio=None):
+    """
+    get_pelvis_virtual_safe를 모든 프레임에 한 번에 적용합니다.
+    pelvis의 전방 벡터를 수평면에 투영하므로 virtual root 회전은 Y축 회전(yaw)만 남습니다.
+    :param ap: (F, 3) pelvis 위치 (world 기준)
+    :param ar: (F, 4) pelvis 회전 (world 기준)
+    :param fallback_forward: 전방 벡터가 거의 수직일 때 사용하는 전방 벡터
+    :param smooth_ratio: None이 아니면 r_inv에 순차 low-pass filter를 적용합니다.
+    :return: (new_ap, new_ar) (F, 3), (F, 4)
+    """
+    ap = np.asarray(ap, dtype=np.float64)
+    ar = np.asarray(ar, dtype=np.float64)
+
+    # 현재 바라보는 방향 벡터 추출 후 수평화
+    f = quat_rotate(ar, np.array([0.0, 0.0, 1.0]))
+    f[:, 1] = 0.0
+    degenerate = np.linalg.norm(f, axis=1) < 1e-4
+    f[degenerate] = (fallback_forward[0], 0.0, fallback_forward[2])
+
+    # lookrotation(f, up)의 역회전 = -yaw 만큼의 Y축 회전
+    inv_yaw = -np.arctan2(f[:, 0], f[:, 2])
+    if smooth_ratio is not None:
+        inv_yaw = smooth_yaw(inv_yaw, smooth_ratio)
+    r_inv = np.zeros((len(ap), 4), dtype=np.float64)
+    r_inv[:, 0] = np.cos(inv_yaw * 0.5)
+    r_inv[:, 2] = np.sin(inv_yaw * 0.5)
+
+    # 수직 성분만 남긴 위치와 회전을 기준 정렬
+    vertical = np.zeros_like(ap)
+    vertical[:, 1] = ap[:, 1]
+    new_ap = quat_rotate(r_inv, vertical)
+    new_ar = quat_mul(r_inv, ar)
+    return new_ap, new_ar
+
+
+
 def extract_xz_plane(kinetics: glm.mat4) -> glm.mat4:
     R_mat = glm.mat3(kinetics)
     yaw = math.atan2(R_mat[2][0], R_mat[2][2])